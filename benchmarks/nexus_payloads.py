@@ -0,0 +1,90 @@
+"""
+Compare the encoding time and peak memory of Nexus payloads as plain dicts and as NexusPayload records.
+
+    python benchmarks/nexus_payloads.py [--count 100000]
+"""
+
+import argparse
+import time
+import tracemalloc
+
+from itoutils.django.nexus.api import encode_json
+from itoutils.django.nexus.payloads import NexusMembership, NexusStructure, NexusUser
+
+
+def user_fields(i):
+    return {
+        "id": str(i),
+        "kind": "employer",
+        "first_name": "Jeanne",
+        "last_name": f"Dupont-{i}",
+        "email": f"jeanne.dupont.{i}@example.com",
+        "phone": "0601020304",
+        "last_login": "2025-01-01T12:00:00+00:00",
+        "auth": "PRO_CONNECT",
+        "department": "75",
+    }
+
+
+def structure_fields(i):
+    return {
+        "id": str(i),
+        "kind": "EI",
+        "siret": f"{i:014d}",
+        "name": f"Structure n°{i}",
+        "phone": "0102030405",
+        "email": f"contact.{i}@example.com",
+        "address_line_1": "1 rue de la Paix",
+        "address_line_2": "",
+        "post_code": "75002",
+        "city": "Paris",
+        "department": "75",
+        "accessibility": None,
+        "description": "Accompagnement à l'emploi",
+        "opening_hours": None,
+        "source_link": f"https://example.com/structures/{i}",
+        "website": None,
+    }
+
+
+def membership_fields(i):
+    return {"id": str(i), "user_id": str(i), "structure_id": str(i % 1000), "role": "admin"}
+
+
+ENTITIES = [
+    ("users", user_fields, NexusUser),
+    ("structures", structure_fields, NexusStructure),
+    ("memberships", membership_fields, NexusMembership),
+]
+
+
+def measure(build, count):
+    tracemalloc.start()
+    records = [build(i) for i in range(count)]
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    # Don't trace the encoding: tracemalloc slows down allocations a lot
+    start = time.perf_counter()
+    size = sum(len(encode_json(record)) for record in records)
+    return time.perf_counter() - start, peak, size
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--count", type=int, default=100_000)
+    count = parser.parse_args().count
+
+    print(f"{'entity':<12} {'records':<8} {'encode (s)':>11} {'peak memory (MiB)':>18}")
+    for name, fields, payload_class in ENTITIES:
+        results = {
+            "dict": measure(fields, count),
+            "payload": measure(lambda i, cls=payload_class, fields=fields: cls(**fields(i)), count),
+        }
+        # Both records must be encoded to the same JSON
+        assert results["dict"][2] == results["payload"][2]
+        for kind, (encode_time, peak, _) in results.items():
+            print(f"{name:<12} {kind:<8} {encode_time:>11.3f} {peak / 2**20:>18.1f}")
+
+
+if __name__ == "__main__":
+    main()
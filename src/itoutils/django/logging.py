@@ -10,12 +10,17 @@ logger = logging.getLogger(__name__)
 class DataDogJSONFormatter(datadog.DataDogJSONFormatter):
     # We don't want those information in our logs
     LOG_KEYS_TO_REMOVE = ["usr.name", "usr.email", "usr.session_key"]
+    # Extra attributes always kept, whatever DJANGO_DATADOG_LOGGER_EXTRA_INCLUDE
+    EXTRA_KEYS_PREFIXES_TO_KEEP = ("nexus.",)
 
     def json_record(self, message, extra, record):
         log_entry_dict = super().json_record(message, extra, record)
         for log_key in self.LOG_KEYS_TO_REMOVE:
             if log_key in log_entry_dict:
                 del log_entry_dict[log_key]
+        for key, value in extra.items():
+            if key.startswith(self.EXTRA_KEYS_PREFIXES_TO_KEEP):
+                log_entry_dict[key] = value
         if (command_info := get_current_command_info()) is not None:
             log_entry_dict["command.run_uid"] = command_info.run_uid
             log_entry_dict["command.name"] = command_info.name
@@ -6,14 +6,15 @@ class HasDataChangedMixin:
     def set_old_values(self):
         self._old_values = self.__dict__.copy()
 
-    def has_data_changed(self, fields):
+    def get_changed_fields(self, fields):
         if self._state.adding:
-            return True
+            return set(fields)
         if hasattr(self, "_old_values"):
-            for field in fields:
-                if getattr(self, field) != self._old_values[field]:
-                    return True
-        return False
+            return {field for field in fields if getattr(self, field) != self._old_values[field]}
+        return set()
+
+    def has_data_changed(self, fields):
+        return bool(self.get_changed_fields(fields))
 
     def save(self, *args, **kwargs):
         super().save(*args, **kwargs)
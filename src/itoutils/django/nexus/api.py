@@ -1,37 +1,528 @@
+import asyncio
+import contextlib
+import email.utils
+import json
 import logging
+import os
+import random
+import threading
+import time
+import urllib.request
+import zlib
+from collections.abc import Iterable
 
 import httpx
 from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+from itoutils.django.nexus.circuit_breaker import get_circuit_breaker
+from itoutils.django.nexus.metrics import get_metrics_sink
+from itoutils.django.nexus.payloads import NexusPayload
+
+try:
+    from compression.zstd import ZstdCompressor as zstd_compressor  # Python >= 3.14
+except ImportError:
+    try:
+        import zstandard
+
+        def zstd_compressor():
+            return zstandard.ZstdCompressor().compressobj()
+    except ImportError:
+        zstd_compressor = None
 
 logger = logging.getLogger(__name__)
 
+# Incremental compressors factories, all returned objects provide compress() and flush()
+COMPRESSORS = {
+    "gzip": lambda: zlib.compressobj(6, zlib.DEFLATED, zlib.MAX_WBITS | 16),
+}
+if zstd_compressor is not None:
+    COMPRESSORS["zstd"] = zstd_compressor
+
 
 class NexusAPIException(Exception):
     pass
 
 
-class NexusAPIClient:
-    def __init__(self):
-        self.client = httpx.Client(
+class NexusCircuitOpenException(NexusAPIException):
+    # Raised without calling Nexus while the circuit breaker is open
+    pass
+
+
+def _pks_payload(pks):
+    # Only streamed when the pks are: deletions of a few objects are sent with a Content-Length
+    payload = ({"id": str(pk)} for pk in pks)
+    return payload if is_streamable(pks) else list(payload)
+
+
+class RetryPolicy:
+    def __init__(
+        self,
+        max_attempts=5,
+        backoff_factor=0.5,
+        max_backoff=60,
+        retry_on_status=(429, 500, 502, 503, 504),
+        retry_on_exceptions=(httpx.TransportError,),
+    ):
+        self.max_attempts = max_attempts
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        self.retry_on_status = frozenset(retry_on_status)
+        self.retry_on_exceptions = tuple(retry_on_exceptions)
+
+    def is_retryable(self, exc):
+        if isinstance(exc, httpx.HTTPStatusError):
+            return exc.response.status_code in self.retry_on_status
+        return isinstance(exc, self.retry_on_exceptions)
+
+    def get_retry_after(self, response):
+        if response is None or (retry_after := response.headers.get("Retry-After")) is None:
+            return None
+        try:
+            return max(float(retry_after), 0)
+        except ValueError:
+            pass
+        try:
+            return max(email.utils.parsedate_to_datetime(retry_after).timestamp() - time.time(), 0)
+        except (TypeError, ValueError):
+            return None
+
+    # Returns the number of seconds to wait before the next attempt, or None to give up
+    def get_delay(self, attempt, exc):
+        if attempt >= self.max_attempts or not self.is_retryable(exc):
+            return None
+        retry_after = self.get_retry_after(getattr(exc, "response", None))
+        if retry_after is not None:
+            # Honour the server's request, unless it asks for more than we are willing to wait
+            return retry_after if retry_after <= self.max_backoff else None
+        # Exponential backoff with "full jitter" to avoid synchronized retries between workers
+        return random.uniform(0, min(self.max_backoff, self.backoff_factor * 2 ** (attempt - 1)))
+
+
+def _encode_nested_payload(obj):
+    if isinstance(obj, NexusPayload):
+        return obj.to_dict()
+    raise TypeError(f"Object of type {obj.__class__.__name__} is not JSON serializable")
+
+
+def encode_json(data):
+    if isinstance(data, NexusPayload):
+        return data.encode_json()
+    # Same encoding as httpx, payloads nested in lists are encoded as dicts
+    return json.dumps(
+        data, ensure_ascii=False, separators=(",", ":"), allow_nan=False, default=_encode_nested_payload
+    ).encode()
+
+
+def compress(compression, data):
+    compressor = COMPRESSORS[compression]()
+    return compressor.compress(data) + compressor.flush()
+
+
+class EncodedBatch:
+    # A JSON array whose items were already encoded, see BaseNexusAPIClient.iter_batches().
+    # When streamed, the body is sent with JSONArrayStream: the items are kept to replay it on retry,
+    # but neither the whole body nor its compressed copy is built.
+    def __init__(self, items, streamed=False):
+        self.items = items
+        self.streamed = streamed
+
+    def __len__(self):
+        return len(self.items)
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def encode(self):
+        return b"[" + b",".join(self.items) + b"]"
+
+
+def is_streamable(data):
+    return isinstance(data, Iterable) and not isinstance(data, (dict, list, tuple, str, bytes, EncodedBatch))
+
+
+class JSONArrayStream:
+    # Encode records as a JSON array on the fly, so that only CHUNK_SIZE bytes are held in memory
+    # instead of the whole body. The stream can be replayed (on retry) unless records is an iterator.
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, records, compression=None, on_compress=None):
+        self.records = records
+        self.compression = compression
+        self.on_compress = on_compress
+        self.raw_size = 0
+        self.size = 0
+        self.item_count = 0
+
+    @property
+    def replayable(self):
+        return iter(self.records) is not self.records
+
+    def iter_raw_chunks(self):
+        buffer = bytearray(b"[")
+        separator = b""
+        for record in self.records:
+            buffer += separator
+            # Items of an EncodedBatch are already encoded
+            buffer += record if isinstance(record, bytes) else encode_json(record)
+            separator = b","
+            self.item_count += 1
+            if len(buffer) >= self.CHUNK_SIZE:
+                yield bytes(buffer)
+                buffer.clear()
+        buffer += b"]"
+        yield bytes(buffer)
+
+    def __iter__(self):
+        self.raw_size = self.size = self.item_count = 0
+        compressor = COMPRESSORS[self.compression]() if self.compression else None
+        for chunk in self.iter_raw_chunks():
+            self.raw_size += len(chunk)
+            if compressor is not None:
+                chunk = compressor.compress(chunk)
+            self.size += len(chunk)
+            if chunk:
+                yield chunk
+        if compressor is not None:
+            chunk = compressor.flush()
+            self.size += len(chunk)
+            yield chunk
+            if self.on_compress is not None:
+                self.on_compress(self.raw_size, self.size)
+
+
+class AsyncJSONArrayStream:
+    # httpx.AsyncClient only accepts async iterables
+    def __init__(self, stream):
+        self.stream = stream
+
+    @property
+    def replayable(self):
+        return self.stream.replayable
+
+    @property
+    def size(self):
+        return self.stream.size
+
+    @property
+    def item_count(self):
+        return self.stream.item_count
+
+    async def __aiter__(self):
+        for chunk in self.stream:
+            yield chunk
+
+
+_shared_transport = None
+_shared_transport_lock = threading.Lock()
+
+
+def get_env_proxy(url):
+    # httpx ignores the HTTP(S)_PROXY, ALL_PROXY and NO_PROXY environment variables when a transport is given
+    if not url:
+        return None
+    url = httpx.URL(url)
+    if urllib.request.proxy_bypass(url.host):
+        return None
+    proxies = urllib.request.getproxies()
+    return proxies.get(url.scheme) or proxies.get("all")
+
+
+def get_shared_transport():
+    # A single connection pool for the whole process: saves a TCP+TLS handshake per NexusAPIClient
+    global _shared_transport
+    with _shared_transport_lock:
+        if _shared_transport is None:
+            _shared_transport = httpx.HTTPTransport(
+                proxy=get_env_proxy(settings.NEXUS_API_BASE_URL),
+                trust_env=True,
+                http2=getattr(settings, "NEXUS_API_HTTP2", False),
+                limits=httpx.Limits(
+                    max_connections=getattr(settings, "NEXUS_API_MAX_CONNECTIONS", 100),
+                    max_keepalive_connections=getattr(settings, "NEXUS_API_MAX_KEEPALIVE_CONNECTIONS", 20),
+                    keepalive_expiry=getattr(settings, "NEXUS_API_KEEPALIVE_EXPIRY", 5),
+                ),
+            )
+        return _shared_transport
+
+
+def close_shared_transport():
+    # To be called on worker shutdown, e.g. from gunicorn's worker_exit hook
+    global _shared_transport
+    with _shared_transport_lock:
+        if _shared_transport is not None:
+            _shared_transport.close()
+            _shared_transport = None
+
+
+def _reset_shared_transport_after_fork():
+    # The child must neither reuse nor close the sockets inherited from the parent (gunicorn --preload):
+    # forget them and start with a fresh pool. The lock may have been held by another thread during the fork.
+    global _shared_transport, _shared_transport_lock
+    _shared_transport = None
+    _shared_transport_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_shared_transport_after_fork)
+
+
+class BaseNexusAPIClient:
+    client_class = None
+    COMPRESSION_THRESHOLD = 16 * 1024  # bytes
+    MAX_BATCH_ITEMS = 5_000
+    MAX_BATCH_BYTES = 8 * 1024 * 1024
+    MIN_BATCH_ITEMS = 100
+
+    def __init__(
+        self,
+        retry_policy=None,
+        compression=None,
+        compression_threshold=None,
+        on_compress=None,
+        limiter=None,
+        metrics_sink=None,
+        circuit_breaker=None,
+        max_batch_items=None,
+        max_batch_bytes=None,
+        target_batch_latency=None,
+    ):
+        self.client = self.client_class(
             base_url=settings.NEXUS_API_BASE_URL,
             headers={"Authorization": f"Token {settings.NEXUS_API_TOKEN}"},
+            **self.get_client_kwargs(),
+        )
+        self.retry_policy = retry_policy
+        if compression is not None and compression not in COMPRESSORS:
+            raise ImproperlyConfigured(
+                f"Unsupported Nexus compression {compression!r}, available: {', '.join(COMPRESSORS)}"
+            )
+        self.compression = compression
+        self.compression_threshold = (
+            self.COMPRESSION_THRESHOLD if compression_threshold is None else compression_threshold
         )
+        # Called with (method, url, raw_size, compressed_size) each time a body is compressed
+        self.on_compress = on_compress
+        # Usually an AdaptiveConcurrencyLimiter shared by the whole process
+        self.limiter = limiter
+        self.metrics_sink = metrics_sink or get_metrics_sink()
+        # Shared by the whole process by default, see get_circuit_breaker()
+        self.circuit_breaker = circuit_breaker or get_circuit_breaker()
+        self.max_batch_items = max_batch_items or self.MAX_BATCH_ITEMS
+        self.max_batch_bytes = max_batch_bytes or self.MAX_BATCH_BYTES
+        # When set (in seconds), batch_size is halved when a batch takes longer and slowly grows back otherwise
+        self.target_batch_latency = target_batch_latency
+        self.batch_size = self.max_batch_items
 
-    def call(self, method, url, **kwargs):
+    def get_client_kwargs(self):
+        return {}
+
+    def build_stream(self, method, url, records):
+        on_compress = None
+        if self.on_compress is not None:
+
+            def on_compress(raw_size, compressed_size):
+                self.on_compress(method, url, raw_size, compressed_size)
+
+        return JSONArrayStream(records, compression=self.compression, on_compress=on_compress)
+
+    def iter_batches(self, records):
+        # Encode records one by one to bound each batch by its number of items and its size in bytes.
+        # Batches of streamable records (e.g. generators) are streamed too, see EncodedBatch.
+        streamed = is_streamable(records)
+        items = []
+        size = 2  # []
+        for record in records:
+            item = encode_json(record)
+            if items and (len(items) >= self.batch_size or size + len(item) > self.max_batch_bytes):
+                yield EncodedBatch(items, streamed=streamed)
+                items = []
+                size = 2
+            items.append(item)
+            size += len(item) + 1  # ,
+        if items:
+            yield EncodedBatch(items, streamed=streamed)
+
+    def adapt_batch_size(self, latency):
+        if self.target_batch_latency is None:
+            return
+        if latency > self.target_batch_latency:
+            self.batch_size = max(self.batch_size // 2, min(self.MIN_BATCH_ITEMS, self.max_batch_items))
+        else:
+            self.batch_size = min(self.batch_size + max(self.batch_size // 10, 1), self.max_batch_items)
+
+    def build_request_kwargs(self, method, url, kwargs):
+        # Encode the body ourselves (once, even if the request is retried) to know its size
+        if "json" not in kwargs:
+            return kwargs
+        kwargs = kwargs.copy()
+        data = kwargs.pop("json")
+        headers = {**kwargs.pop("headers", {}), "Content-Type": "application/json"}
+        if is_streamable(data) or (isinstance(data, EncodedBatch) and data.streamed):
+            # The body size is unknown beforehand: always compress if enabled
+            content = self.build_stream(method, url, data)
+            if self.compression is not None:
+                headers["Content-Encoding"] = self.compression
+        else:
+            content = data.encode() if isinstance(data, EncodedBatch) else encode_json(data)
+            if self.compression is not None and len(content) >= self.compression_threshold:
+                raw_size = len(content)
+                content = compress(self.compression, content)
+                headers["Content-Encoding"] = self.compression
+                if self.on_compress is not None:
+                    self.on_compress(method, url, raw_size, len(content))
+        return {**kwargs, "content": content, "headers": headers}
+
+    def get_retry_delay(self, method, url, exc, attempt, replayable=True):
+        if self.retry_policy is None or (delay := self.retry_policy.get_delay(attempt, exc)) is None:
+            return None
+        if not replayable:
+            logger.warning(f"nexus {method}:{url} cannot be retried: the request body was streamed from an iterator")
+            return None
+        logger.warning(
+            f"nexus {method}:{url} attempt %d/%d failed, retrying in %0.2f seconds error=%s",
+            attempt,
+            self.retry_policy.max_attempts,
+            delay,
+            exc,
+            extra={"nexus.attempt": attempt, "nexus.retry_delay": delay},
+        )
+        return delay
+
+    def log_retries(self, method, url, attempt, duration_in_ns, result):
+        if attempt > 1:
+            logger.info(
+                f"nexus {method}:{url} {result} after %d attempts in %0.2f seconds",
+                attempt,
+                duration_in_ns / 1_000_000_000,
+                extra={
+                    "nexus.retries": attempt - 1,
+                    # Datadog expects duration in ns
+                    "duration": duration_in_ns,
+                },
+            )
+
+    def check_circuit(self, method, url):
+        if self.circuit_breaker is not None and not self.circuit_breaker.allow_request():
+            logger.warning(f"nexus {method}:{url} skipped: circuit breaker is {self.circuit_breaker.state}")
+            raise NexusCircuitOpenException
+
+    def record_circuit_result(self, exc=None):
+        if self.circuit_breaker is not None:
+            self.circuit_breaker.record_result(exc)
+
+    def release_circuit(self):
+        if self.circuit_breaker is not None:
+            self.circuit_breaker.release()
+
+    def log_metrics(self, method, url, data, content, attempt, duration_in_ns, response=None, exc=None):
+        if response is None:
+            response = getattr(exc, "response", None)
+        status = response.status_code if response is not None else exc.__class__.__name__
+        if isinstance(content, bytes):
+            request_bytes = len(content)
+        else:
+            request_bytes = getattr(content, "size", 0)
+        response_bytes = len(response.content) if response is not None else 0
+        if isinstance(data, (list, tuple, EncodedBatch)):
+            item_count = len(data)
+        else:
+            item_count = getattr(content, "item_count", None)
+        logger.info(
+            f"nexus {method}:{url} status=%s",
+            status,
+            extra={
+                # Not http.* nor network.* since they would override the current request attributes
+                "nexus.method": method,
+                "nexus.endpoint": url,
+                "nexus.status_code": response.status_code if response is not None else None,
+                "nexus.request_bytes": request_bytes,
+                "nexus.response_bytes": response_bytes,
+                "nexus.item_count": item_count,
+                "nexus.attempts": attempt,
+                # Datadog expects duration in ns
+                "duration": duration_in_ns,
+            },
+        )
+        if self.metrics_sink is not None:
+            tags = {"method": method, "endpoint": url, "status": str(status)}
+            self.metrics_sink.increment("nexus.requests", tags)
+            self.metrics_sink.histogram("nexus.request.duration", duration_in_ns / 1_000_000_000, tags)
+            self.metrics_sink.histogram("nexus.request.bytes", request_bytes, tags)
+            self.metrics_sink.histogram("nexus.response.bytes", response_bytes, tags)
+            if item_count is not None:
+                self.metrics_sink.histogram("nexus.request.items", item_count, tags)
+
+    def handle_error(self, method, url, exc):
+        err_response = getattr(exc, "response", None)
         try:
-            response = self.client.request(method, url, **kwargs).raise_for_status()
-        except httpx.HTTPError as exc:
-            err_response = getattr(exc, "response", None)
-            try:
-                error = err_response.json() if err_response is not None else str(exc)
-            except Exception:
-                error = str(exc)
-            logger.exception(f"nexus {method}:{url} error=%s", error)
-            raise NexusAPIException from exc
+            error = err_response.json() if err_response is not None else str(exc)
+        except Exception:
+            error = str(exc)
+        logger.exception(f"nexus {method}:{url} error=%s", error)
+        raise NexusAPIException from exc
+
+    def handle_response(self, method, url, response):
         if errors := response.json().get("errors"):
             logger.error(f"nexus {method}:{url} error=%s", errors)
         return response
 
+
+class NexusAPIClient(BaseNexusAPIClient):
+    client_class = httpx.Client
+
+    def get_client_kwargs(self):
+        # Never close self.client: it would close the shared transport
+        return {"transport": get_shared_transport()}
+
+    def send(self, method, url, **kwargs):
+        self.check_circuit(method, url)
+        try:
+            with self.limiter.track() if self.limiter is not None else contextlib.nullcontext():
+                response = self.client.request(method, url, **kwargs).raise_for_status()
+        except Exception as exc:
+            self.record_circuit_result(exc)
+            raise
+        except BaseException:
+            # Cancelled (e.g. by send_many's TaskGroup) or interrupted: the call didn't complete
+            self.release_circuit()
+            raise
+        self.record_circuit_result()
+        return response
+
+    def call(self, method, url, **kwargs):
+        data = kwargs.get("json")
+        kwargs = self.build_request_kwargs(method, url, kwargs)
+        content = kwargs.get("content")
+        replayable = getattr(content, "replayable", True)
+        before = time.perf_counter_ns()
+        attempt = 1
+        while True:
+            try:
+                response = self.send(method, url, **kwargs)
+                break
+            except httpx.HTTPError as exc:
+                if (delay := self.get_retry_delay(method, url, exc, attempt, replayable)) is None:
+                    duration_in_ns = time.perf_counter_ns() - before
+                    self.log_retries(method, url, attempt, duration_in_ns, "failed")
+                    self.log_metrics(method, url, data, content, attempt, duration_in_ns, exc=exc)
+                    self.handle_error(method, url, exc)
+                time.sleep(delay)
+                attempt += 1
+        duration_in_ns = time.perf_counter_ns() - before
+        self.log_retries(method, url, attempt, duration_in_ns, "succeeded")
+        self.log_metrics(method, url, data, content, attempt, duration_in_ns, response=response)
+        return self.handle_response(method, url, response)
+
+    def call_batches(self, method, url, records):
+        if isinstance(records, dict):
+            # Not a list of records, nothing to split
+            self.call(method, url, json=records)
+            return
+        for batch in self.iter_batches(records):
+            before = time.monotonic()
+            self.call(method, url, json=batch)
+            self.adapt_batch_size(time.monotonic() - before)
+
     def init_full_sync(self):
         return self.call("POST", "sync-start").json()["started_at"]
 
@@ -39,22 +530,136 @@ class NexusAPIClient:
         self.call("POST", "sync-completed", json={"started_at": start_at})
 
     def send_users(self, users_data):
-        self.call("POST", "users", json=users_data)
+        self.call_batches("POST", "users", users_data)
 
     def delete_users(self, user_pks):
-        self.call("DELETE", "users", json=[{"id": str(user_pk)} for user_pk in user_pks])
+        self.call_batches("DELETE", "users", _pks_payload(user_pks))
 
     def send_structures(self, structures_data):
-        self.call("POST", "structures", json=structures_data)
+        self.call_batches("POST", "structures", structures_data)
 
     def delete_structures(self, structure_pks):
-        self.call("DELETE", "structures", json=[{"id": str(structure_pk)} for structure_pk in structure_pks])
+        self.call_batches("DELETE", "structures", _pks_payload(structure_pks))
 
     def send_memberships(self, memberships_data):
-        self.call("POST", "memberships", json=memberships_data)
+        self.call_batches("POST", "memberships", memberships_data)
 
     def delete_memberships(self, membership_pks):
-        self.call("DELETE", "memberships", json=[{"id": str(membership_pk)} for membership_pk in membership_pks])
+        self.call_batches("DELETE", "memberships", _pks_payload(membership_pks))
 
     def dropdown_status(self, email):
         return self.call("POST", "dropdown-status", json={"email": email}).json()
+
+
+class AsyncNexusAPIClient(BaseNexusAPIClient):
+    # Async connections are bound to their event loop: each instance has its own pool, to close with aclose()
+    client_class = httpx.AsyncClient
+    MAX_IN_FLIGHT = 4
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    async def aclose(self):
+        await self.client.aclose()
+
+    def build_stream(self, method, url, records):
+        return AsyncJSONArrayStream(super().build_stream(method, url, records))
+
+    async def send(self, method, url, **kwargs):
+        self.check_circuit(method, url)
+        try:
+            async with self.limiter.track_async() if self.limiter is not None else contextlib.nullcontext():
+                response = (await self.client.request(method, url, **kwargs)).raise_for_status()
+        except Exception as exc:
+            self.record_circuit_result(exc)
+            raise
+        except BaseException:
+            # Cancelled (e.g. by send_many's TaskGroup) or interrupted: the call didn't complete
+            self.release_circuit()
+            raise
+        self.record_circuit_result()
+        return response
+
+    async def call(self, method, url, **kwargs):
+        data = kwargs.get("json")
+        kwargs = self.build_request_kwargs(method, url, kwargs)
+        content = kwargs.get("content")
+        replayable = getattr(content, "replayable", True)
+        before = time.perf_counter_ns()
+        attempt = 1
+        while True:
+            try:
+                response = await self.send(method, url, **kwargs)
+                break
+            except httpx.HTTPError as exc:
+                if (delay := self.get_retry_delay(method, url, exc, attempt, replayable)) is None:
+                    duration_in_ns = time.perf_counter_ns() - before
+                    self.log_retries(method, url, attempt, duration_in_ns, "failed")
+                    self.log_metrics(method, url, data, content, attempt, duration_in_ns, exc=exc)
+                    self.handle_error(method, url, exc)
+                await asyncio.sleep(delay)
+                attempt += 1
+        duration_in_ns = time.perf_counter_ns() - before
+        self.log_retries(method, url, attempt, duration_in_ns, "succeeded")
+        self.log_metrics(method, url, data, content, attempt, duration_in_ns, response=response)
+        return self.handle_response(method, url, response)
+
+    async def call_batches(self, method, url, records):
+        if isinstance(records, dict):
+            # Not a list of records, nothing to split
+            await self.call(method, url, json=records)
+            return
+        for batch in self.iter_batches(records):
+            before = time.monotonic()
+            await self.call(method, url, json=batch)
+            self.adapt_batch_size(time.monotonic() - before)
+
+    async def init_full_sync(self):
+        return (await self.call("POST", "sync-start")).json()["started_at"]
+
+    async def complete_full_sync(self, start_at):
+        await self.call("POST", "sync-completed", json={"started_at": start_at})
+
+    async def send_users(self, users_data):
+        await self.call_batches("POST", "users", users_data)
+
+    async def delete_users(self, user_pks):
+        await self.call_batches("DELETE", "users", _pks_payload(user_pks))
+
+    async def send_structures(self, structures_data):
+        await self.call_batches("POST", "structures", structures_data)
+
+    async def delete_structures(self, structure_pks):
+        await self.call_batches("DELETE", "structures", _pks_payload(structure_pks))
+
+    async def send_memberships(self, memberships_data):
+        await self.call_batches("POST", "memberships", memberships_data)
+
+    async def delete_memberships(self, membership_pks):
+        await self.call_batches("DELETE", "memberships", _pks_payload(membership_pks))
+
+    async def dropdown_status(self, email):
+        return (await self.call("POST", "dropdown-status", json={"email": email})).json()
+
+    async def send_many(self, send, batches, max_in_flight=None):
+        # Keep at most `max_in_flight` requests running: the next batch is only pulled
+        # from `batches` once a slot is free, so a lazy iterable is never fully materialized.
+        semaphore = asyncio.Semaphore(max_in_flight or self.MAX_IN_FLIGHT)
+
+        async def send_batch(batch):
+            try:
+                await send(batch)
+            finally:
+                semaphore.release()
+
+        try:
+            async with asyncio.TaskGroup() as task_group:
+                for batch in batches:
+                    await semaphore.acquire()
+                    task_group.create_task(send_batch(batch))
+        except ExceptionGroup as exc_group:
+            # Surface the first failure as is so that callers can keep catching NexusAPIException
+            raise exc_group.exceptions[0] from exc_group
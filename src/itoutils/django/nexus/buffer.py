@@ -0,0 +1,169 @@
+import contextlib
+import itertools
+
+from django.db import transaction
+from django.db.models import Q
+from django.db.models.constants import LOOKUP_SEP
+
+BATCH_SIZE = 10_000
+
+
+def get_nexus_queryset(model, using=None):
+    queryset = model._default_manager.all()
+    if hasattr(queryset, "_get_nexus_queryset"):
+        queryset = queryset._get_nexus_queryset()
+    return queryset.using(using)
+
+
+def get_condition_fields(model, condition):
+    # The fields (attnames) of the model used by a Q, None when they can't be known (e.g. expressions)
+    fields = set()
+    for child in condition.children:
+        if isinstance(child, Q):
+            if (child_fields := get_condition_fields(model, child)) is None:
+                return None
+            fields |= child_fields
+        elif isinstance(child, tuple):
+            name = child[0].split(LOOKUP_SEP)[0]
+            field = model._meta.pk if name == "pk" else model._meta.get_field(name)
+            fields.add(getattr(field, "attname", field.name))
+        else:
+            return None
+    return fields
+
+
+def sync_or_delete(model, pks, using=None, changed_fields=None):
+    # The database state decides: existing objects are synced or deleted depending on should_sync_to_nexus(),
+    # objects that don't exist anymore are deleted.
+    # changed_fields maps pks to the tracked fields that changed, when they are known: objects whose changes
+    # are all in model.nexus_partial_fields are sent with nexus_partial_sync() instead of nexus_sync().
+    # With model.nexus_sync_condition, only the objects to sync are fetched: the others are deleted
+    partial_fields = frozenset(model.nexus_partial_fields or ()) if model.nexus_partial_sync else frozenset()
+    changed_fields = changed_fields or {}
+    condition = model.nexus_sync_condition
+    if partial_fields and condition is not None:
+        # Changing them may add the object to Nexus: it must then be fully synced
+        condition_fields = get_condition_fields(model, condition)
+        partial_fields = frozenset() if condition_fields is None else partial_fields - condition_fields
+    for batch in itertools.batched(pks, BATCH_SIZE):
+        seen_pks = set()
+        to_sync = []
+        to_patch = []
+        to_delete = []
+        queryset = get_nexus_queryset(model, using).filter(pk__in=batch)
+        if condition is not None:
+            # In a subquery, since a condition crossing a multi-valued relation would duplicate the objects
+            queryset = queryset.filter(pk__in=model._base_manager.filter(condition).values("pk"))
+        for obj in queryset:
+            seen_pks.add(obj.pk)
+            if condition is None and not obj.should_sync_to_nexus():
+                to_delete.append(obj.pk)
+            elif (fields := changed_fields.get(obj.pk)) and fields <= partial_fields:
+                to_patch.append((obj, fields))
+            else:
+                to_sync.append(obj)
+        if to_sync:
+            model.nexus_sync(to_sync)
+        if to_patch:
+            model.nexus_partial_sync(to_patch)
+        to_delete.extend(pk for pk in batch if pk not in seen_pks)
+        if to_delete:
+            model.nexus_delete(to_delete)
+
+
+class NexusSyncBuffer:
+    # Collect the pks of the Nexus objects changed during a transaction, to send a single nexus_sync()
+    # and nexus_delete() call per model on commit instead of one call per saved object.
+    # The database state on commit decides whether an object is synced or deleted, so the last change
+    # always wins, even when a savepoint was rolled back.
+    def __init__(self, using):
+        self.using = using
+        self.pks = {}
+        self.flushed = False
+
+    def add(self, model, pks, fields=None):
+        # Imported here to avoid a circular import
+        from itoutils.django.nexus.models import NexusModelMixin
+
+        if not issubclass(model, NexusModelMixin):
+            return
+        if model.nexus_use_triggers:
+            # Already captured by the database
+            return
+        if model.nexus_use_outbox:
+            # Imported here since the outbox app is optional
+            from itoutils.django.nexus.outbox.models import OutboxEntry
+
+            # Saved in the same transaction, and sent later by the drain_nexus_outbox command
+            OutboxEntry.objects.add(model, pks, using=self.using)
+            return
+        # Changed fields by pk, None when unknown (e.g. for created objects): the whole object must be sent
+        changes = self.pks.setdefault(model, {})
+        for pk in pks:
+            if fields is None or changes.get(pk, frozenset()) is None:
+                changes[pk] = None
+            else:
+                changes[pk] = changes.get(pk, frozenset()) | fields
+        # Registered once per change, like a plain on_commit(), so that only the first call flushes the
+        # buffer. It also keeps TestCase.captureOnCommitCallbacks() working.
+        transaction.on_commit(self, using=self.using)
+
+    def is_pending(self, connection):
+        if self.flushed or not connection.in_atomic_block:
+            return False
+        # The buffer is usually the last callback, but it may have been dropped with a rolled back transaction
+        return any(func is self for _, func, _ in reversed(connection.run_on_commit))
+
+    def __call__(self):
+        if self.flushed:
+            return
+        self.flushed = True
+        for model, changes in self.pks.items():
+            if model.nexus_use_dispatcher:
+                # Imported here to avoid a circular import
+                from itoutils.django.nexus.dispatcher import get_dispatcher
+
+                get_dispatcher().submit(model, list(changes), using=self.using)
+            else:
+                sync_or_delete(model, list(changes), using=self.using, changed_fields=changes)
+
+
+class DeferredNexusSync:
+    # Only record the pks of the changed objects, see defer_nexus_sync()
+    def __init__(self):
+        self.pks = {}
+
+    def add(self, model, pks, fields=None):
+        # Changed fields are not kept: the objects are fully synced. A dict keeps the pks in order
+        self.pks.setdefault(model, {}).update(dict.fromkeys(pks))
+
+
+@contextlib.contextmanager
+def defer_nexus_sync(using=None):
+    # For data migrations and commands changing many Nexus objects: within this scope, changes don't register
+    # an on_commit callback (or write an outbox entry) each, they are handed over to the buffer on exit.
+    # Outside of a transaction, they are then sent right away by batches.
+    connection = transaction.get_connection(using)
+    if not hasattr(connection, "nexus_deferred_syncs"):
+        connection.nexus_deferred_syncs = []
+    deferred = DeferredNexusSync()
+    connection.nexus_deferred_syncs.append(deferred)
+    try:
+        yield deferred
+    finally:
+        connection.nexus_deferred_syncs.remove(deferred)
+        # Otherwise the transaction will be rolled back with the changes
+        if not connection.needs_rollback:
+            buffer = get_sync_buffer(connection.alias)
+            for model, pks in deferred.pks.items():
+                buffer.add(model, pks)
+
+
+def get_sync_buffer(using=None):
+    connection = transaction.get_connection(using)
+    if deferred_syncs := getattr(connection, "nexus_deferred_syncs", None):
+        return deferred_syncs[-1]
+    buffer = getattr(connection, "nexus_sync_buffer", None)
+    if buffer is None or not buffer.is_pending(connection):
+        buffer = connection.nexus_sync_buffer = NexusSyncBuffer(connection.alias)
+    return buffer
@@ -0,0 +1,102 @@
+import hashlib
+import logging
+import threading
+import time
+
+from django.core.cache import caches
+from django.db import connections
+
+from itoutils.django.nexus.api import NexusAPIClient, NexusAPIException
+
+logger = logging.getLogger(__name__)
+
+
+class DropdownStatusCache:
+    # Cache NexusAPIClient.dropdown_status() results in a Django cache:
+    # - during TTL seconds the cached value is returned without calling Nexus
+    # - during the following STALE_TTL seconds it is still returned, but refreshed in a background thread
+    # - errors are cached ERROR_TTL seconds (None is returned) to avoid hammering a failing Nexus
+    TTL = 60
+    STALE_TTL = 10 * 60
+    ERROR_TTL = 30
+    KEY_PREFIX = "nexus:dropdown-status"
+
+    def __init__(self, ttl=None, stale_ttl=None, error_ttl=None, cache_alias="default", client_class=NexusAPIClient):
+        self.ttl = self.TTL if ttl is None else ttl
+        self.stale_ttl = self.STALE_TTL if stale_ttl is None else stale_ttl
+        self.error_ttl = self.ERROR_TTL if error_ttl is None else error_ttl
+        self.cache_alias = cache_alias
+        self.client_class = client_class
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias]
+
+    def get_key(self, email):
+        # Don't put emails in cache keys: they may contain characters unsupported by memcached
+        return f"{self.KEY_PREFIX}:{hashlib.sha256(email.lower().encode()).hexdigest()}"
+
+    def store(self, email, value, ttl, stale_ttl):
+        self.cache.set(self.get_key(email), (value, time.time() + ttl), timeout=ttl + stale_ttl)
+
+    def refresh(self, email):
+        try:
+            value = self.client_class().dropdown_status(email)
+        except NexusAPIException:
+            # The client already logged the error
+            self.store(email, None, self.error_ttl, 0)
+            return None
+        self.store(email, value, self.ttl, self.stale_ttl)
+        return value
+
+    def refresh_stale(self, email, stale_value):
+        try:
+            value = self.client_class().dropdown_status(email)
+        except NexusAPIException:
+            # Keep serving the stale value, but don't retry before ERROR_TTL
+            self.store(email, stale_value, self.error_ttl, self.stale_ttl)
+            return
+        self.store(email, value, self.ttl, self.stale_ttl)
+
+    def refresh_in_background(self, email, stale_value):
+        # Only one refresh at a time for a given email, across processes
+        lock_key = f"{self.get_key(email)}:refreshing"
+        if not self.cache.add(lock_key, True, timeout=max(self.error_ttl, 1)):
+            return
+
+        def target():
+            try:
+                self.refresh_stale(email, stale_value)
+            except Exception:
+                logger.exception("nexus dropdown status refresh failed")
+            finally:
+                self.cache.delete(lock_key)
+                connections.close_all()
+
+        self.run_in_background(target)
+
+    def run_in_background(self, target):
+        threading.Thread(target=target, name="nexus-dropdown-status-refresh", daemon=True).start()
+
+    def get(self, email):
+        entry = self.cache.get(self.get_key(email))
+        if entry is None:
+            return self.refresh(email)
+        value, fresh_until = entry
+        if time.time() >= fresh_until:
+            self.refresh_in_background(email, value)
+        return value
+
+    def invalidate(self, email):
+        self.cache.delete(self.get_key(email))
+
+
+dropdown_status_cache = DropdownStatusCache()
+
+
+def cached_dropdown_status(email):
+    return dropdown_status_cache.get(email)
+
+
+def invalidate_dropdown_status(email):
+    dropdown_status_cache.invalidate(email)
@@ -0,0 +1,131 @@
+import enum
+import logging
+import os
+import threading
+import time
+
+import httpx
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitState(enum.StrEnum):
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+
+class CircuitBreaker:
+    # Stop calling Nexus once it failed `failure_threshold` times in a row: for `recovery_timeout` seconds
+    # calls fail immediately instead of waiting for the httpx timeout. Then up to `half_open_max_calls`
+    # trial calls are let through: the circuit closes if they succeed, and opens again otherwise.
+    # A trial call which neither succeeded nor failed (e.g. cancelled) gives its slot back with release(),
+    # and trials without any result after `recovery_timeout` seconds are considered lost.
+    # Share a single instance between the clients of the process, see get_circuit_breaker().
+    def __init__(self, failure_threshold=5, recovery_timeout=30, half_open_max_calls=1):
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self.state = CircuitState.CLOSED
+        self.failure_count = 0
+        self.half_open_calls = 0
+        self.opened_at = None
+        self.half_opened_at = None
+        self._lock = threading.Lock()
+
+    def is_failure(self, exc):
+        # A 4xx answer means that Nexus is up and running
+        if isinstance(exc, httpx.HTTPStatusError):
+            return exc.response.status_code >= 500
+        return isinstance(exc, httpx.TransportError)
+
+    def allow_request(self):
+        with self._lock:
+            if self.state == CircuitState.OPEN:
+                if time.monotonic() - self.opened_at < self.recovery_timeout:
+                    return False
+                self._set_state(CircuitState.HALF_OPEN)
+                self.half_open_calls = 0
+                self.half_opened_at = time.monotonic()
+            if self.state == CircuitState.HALF_OPEN:
+                if self.half_open_calls >= self.half_open_max_calls:
+                    if time.monotonic() - self.half_opened_at < self.recovery_timeout:
+                        return False
+                    # The trial calls never reported back: start new ones
+                    self.half_open_calls = 0
+                    self.half_opened_at = time.monotonic()
+                self.half_open_calls += 1
+            return True
+
+    def release(self):
+        # For a call which was allowed but didn't complete: no result to record
+        with self._lock:
+            if self.state == CircuitState.HALF_OPEN and self.half_open_calls > 0:
+                self.half_open_calls -= 1
+
+    def record_success(self):
+        with self._lock:
+            self.failure_count = 0
+            if self.state != CircuitState.CLOSED:
+                self._set_state(CircuitState.CLOSED)
+
+    def record_failure(self):
+        with self._lock:
+            self.failure_count += 1
+            if self.state == CircuitState.HALF_OPEN or self.failure_count >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+                if self.state != CircuitState.OPEN:
+                    self._set_state(CircuitState.OPEN)
+
+    def record_result(self, exc=None):
+        if exc is not None and self.is_failure(exc):
+            self.record_failure()
+        else:
+            self.record_success()
+
+    def _set_state(self, state):
+        logger.log(
+            logging.INFO if state == CircuitState.CLOSED else logging.WARNING,
+            "nexus circuit breaker %s -> %s",
+            self.state,
+            state,
+            extra={"nexus.circuit_state": str(state)},
+        )
+        self.state = state
+
+
+_circuit_breaker = None
+_circuit_breaker_lock = threading.Lock()
+
+
+def get_circuit_breaker():
+    # The circuit breaker shared by the clients of the process, None when disabled
+    # with NEXUS_API_CIRCUIT_BREAKER_FAILURE_THRESHOLD = None
+    global _circuit_breaker
+    failure_threshold = getattr(settings, "NEXUS_API_CIRCUIT_BREAKER_FAILURE_THRESHOLD", 5)
+    if failure_threshold is None:
+        return None
+    with _circuit_breaker_lock:
+        if _circuit_breaker is None:
+            _circuit_breaker = CircuitBreaker(
+                failure_threshold=failure_threshold,
+                recovery_timeout=getattr(settings, "NEXUS_API_CIRCUIT_BREAKER_RECOVERY_TIMEOUT", 30),
+            )
+        return _circuit_breaker
+
+
+def reset_circuit_breaker():
+    # Forget the shared circuit breaker state, e.g. between tests
+    global _circuit_breaker
+    with _circuit_breaker_lock:
+        _circuit_breaker = None
+
+
+def _reset_circuit_breaker_after_fork():
+    global _circuit_breaker, _circuit_breaker_lock
+    _circuit_breaker = None
+    _circuit_breaker_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_circuit_breaker_after_fork)
@@ -0,0 +1,158 @@
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections, connections
+
+from itoutils.django.nexus.buffer import sync_or_delete
+from itoutils.django.nexus.metrics import get_metrics_sink
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class NexusDispatcher:
+    # Send the Nexus changes from background threads, so that responses don't wait for Nexus.
+    # Changes arriving within `batch_window` seconds are sent together (up to `max_batch_items` pks).
+    # When the queue is full, changes are sent inline by the committing thread: they are never dropped.
+    # Unlike the outbox, queued changes are lost if the process is killed: shutdown() sends them on exit.
+    def __init__(self, max_queue_size=10_000, workers=1, batch_window=0.5, max_batch_items=5_000, metrics_sink=None):
+        self.queue = queue.Queue(maxsize=max_queue_size)
+        self.workers = workers
+        self.batch_window = batch_window
+        self.max_batch_items = max_batch_items
+        self.metrics_sink = metrics_sink or get_metrics_sink()
+        self.threads = []
+        self._lock = threading.Lock()
+
+    def increment(self, name):
+        if self.metrics_sink is not None:
+            self.metrics_sink.increment(name, {})
+
+    def histogram(self, name, value):
+        if self.metrics_sink is not None:
+            self.metrics_sink.histogram(name, value, {})
+
+    def start(self):
+        with self._lock:
+            if self.threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self.run, name=f"nexus-dispatcher-{i}", daemon=True)
+                thread.start()
+                self.threads.append(thread)
+
+    def submit(self, model, pks, using=None):
+        self.start()
+        overflow = []
+        for pk in pks:
+            try:
+                self.queue.put_nowait((model, using, pk))
+            except queue.Full:
+                overflow.append(pk)
+        if overflow:
+            logger.warning(
+                "nexus dispatcher queue is full, sending %d changes inline",
+                len(overflow),
+                extra={"nexus.dispatcher_overflow": len(overflow)},
+            )
+            self.increment("nexus.dispatcher.overflow")
+            self.histogram("nexus.dispatcher.overflow_items", len(overflow))
+            sync_or_delete(model, overflow, using=using)
+
+    def get_batch(self):
+        # Block until a first change arrives, then wait up to batch_window for others
+        items = [self.queue.get()]
+        deadline = time.monotonic() + self.batch_window
+        while items[-1] is not _STOP and len(items) < self.max_batch_items:
+            timeout = deadline - time.monotonic()
+            try:
+                items.append(self.queue.get(timeout=timeout) if timeout > 0 else self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return items
+
+    def send(self, items):
+        self.histogram("nexus.dispatcher.batch_items", len(items))
+        self.histogram("nexus.dispatcher.queue_size", self.queue.qsize())
+        by_model = {}
+        for model, using, pk in items:
+            by_model.setdefault((model, using), {})[pk] = None
+        # Don't reuse a connection closed by the database, or older than CONN_MAX_AGE
+        close_old_connections()
+        for (model, using), pks in by_model.items():
+            try:
+                sync_or_delete(model, list(pks), using=using)
+            except Exception:
+                logger.exception("nexus dispatcher failed to send %d changes", len(pks))
+                self.increment("nexus.dispatcher.errors")
+
+    def run(self):
+        try:
+            while True:
+                items = self.get_batch()
+                stop = items[-1] is _STOP
+                changes = items[:-1] if stop else items
+                try:
+                    if changes:
+                        self.send(changes)
+                finally:
+                    for _ in items:
+                        self.queue.task_done()
+                if stop:
+                    return
+        finally:
+            connections.close_all()
+
+    def flush(self):
+        # Wait until every queued change was sent
+        self.queue.join()
+
+    def shutdown(self):
+        with self._lock:
+            threads, self.threads = self.threads, []
+        # Queued after the pending changes: workers send them before stopping
+        for _ in threads:
+            self.queue.put(_STOP)
+        for thread in threads:
+            thread.join()
+
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_dispatcher():
+    global _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is None:
+            _dispatcher = NexusDispatcher(
+                max_queue_size=getattr(settings, "NEXUS_DISPATCHER_QUEUE_SIZE", 10_000),
+                workers=getattr(settings, "NEXUS_DISPATCHER_WORKERS", 1),
+                batch_window=getattr(settings, "NEXUS_DISPATCHER_BATCH_WINDOW", 0.5),
+            )
+        return _dispatcher
+
+
+def shutdown_dispatcher():
+    global _dispatcher
+    with _dispatcher_lock:
+        dispatcher, _dispatcher = _dispatcher, None
+    if dispatcher is not None:
+        dispatcher.shutdown()
+
+
+def _reset_dispatcher_after_fork():
+    # Threads don't survive a fork: the child starts its own workers on first use
+    global _dispatcher, _dispatcher_lock
+    _dispatcher = None
+    _dispatcher_lock = threading.Lock()
+
+
+atexit.register(shutdown_dispatcher)
+os.register_at_fork(after_in_child=_reset_dispatcher_after_fork)
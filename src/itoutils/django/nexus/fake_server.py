@@ -0,0 +1,317 @@
+"""
+A local stand-in for the Nexus API, to test NexusAPIClient throughput and failure handling.
+
+Use the fake_nexus_server pytest fixture, or run it for load tests:
+
+    python -m itoutils.django.nexus.fake_server --port 8000 --latency 0.05 --error-rate 0.01
+
+and point NEXUS_API_BASE_URL to http://127.0.0.1:8000/api/
+"""
+
+import argparse
+import dataclasses
+import datetime
+import gzip
+import json
+import random
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+try:
+    from compression.zstd import decompress as zstd_decompress  # Python >= 3.14
+except ImportError:
+    try:
+        import zstandard
+
+        def zstd_decompress(data):
+            return zstandard.ZstdDecompressor().decompressobj().decompress(data)
+    except ImportError:
+        zstd_decompress = None
+
+DECOMPRESSORS = {"gzip": gzip.decompress}
+if zstd_decompress is not None:
+    DECOMPRESSORS["zstd"] = zstd_decompress
+
+ENTITIES = ("users", "structures", "memberships")
+ENDPOINTS = {
+    ("POST", "sync-start"),
+    ("POST", "sync-completed"),
+    ("POST", "dropdown-status"),
+    *((method, entity) for entity in ENTITIES for method in ("POST", "DELETE")),
+}
+
+
+class BadRequest(Exception):
+    pass
+
+
+@dataclasses.dataclass
+class ReceivedRequest:
+    method: str
+    endpoint: str
+    headers: dict
+    body_size: int
+    payload: object
+
+
+@dataclasses.dataclass
+class Fault:
+    # Matches every request when method and endpoint are None
+    method: str | None = None
+    endpoint: str | None = None
+    status: int | None = None
+    # Seconds to wait before answering
+    latency: float = 0
+    # Don't answer at all: the connection is closed after timeout_delay seconds (or when the server stops)
+    timeout: bool = False
+    retry_after: str | None = None
+    # Number of matching requests to apply the fault to, None for all of them
+    times: int | None = 1
+
+    def matches(self, method, endpoint):
+        return self.method in (None, method) and self.endpoint in (None, endpoint)
+
+
+class FakeNexusRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "FakeNexus"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        self.handle_api_request("POST")
+
+    def do_DELETE(self):
+        self.handle_api_request("DELETE")
+
+    def read_body(self):
+        if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+            chunks = []
+            while size := int(self.rfile.readline().split(b";")[0], 16):
+                chunks.append(self.rfile.read(size))
+                self.rfile.readline()
+            # Trailers
+            while self.rfile.readline() not in (b"\r\n", b"\n", b""):
+                pass
+            body = b"".join(chunks)
+        else:
+            body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if encoding := self.headers.get("Content-Encoding"):
+            if encoding not in DECOMPRESSORS:
+                raise BadRequest(f"unsupported Content-Encoding {encoding}")
+            body = DECOMPRESSORS[encoding](body)
+        return body
+
+    def handle_api_request(self, method):
+        fake_server = self.server.fake_server
+        prefix = fake_server.path_prefix
+        endpoint = self.path.removeprefix(prefix) if self.path.startswith(prefix) else None
+        try:
+            body = self.read_body()
+        except (BadRequest, ValueError, OSError) as e:
+            return self.send_json(400, {"errors": [str(e)]})
+
+        if fault := fake_server.pop_fault(method, endpoint):
+            if fault.timeout:
+                fake_server.stopping.wait(fake_server.timeout_delay)
+                self.close_connection = True
+                return
+            if fault.latency:
+                time.sleep(fault.latency)
+            if fault.status is not None:
+                headers = {"Retry-After": fault.retry_after} if fault.retry_after is not None else {}
+                return self.send_json(fault.status, {}, headers)
+
+        if fake_server.token is not None and self.headers.get("Authorization") != f"Token {fake_server.token}":
+            return self.send_json(401, {"detail": "Invalid token"})
+        if (method, endpoint) not in ENDPOINTS:
+            return self.send_json(404, {"detail": "Not found"})
+        try:
+            payload = json.loads(body) if body else None
+            status, data = fake_server.process(method, endpoint, payload)
+        except (BadRequest, ValueError) as e:
+            status, data = 400, {"errors": [str(e)]}
+        fake_server.record(ReceivedRequest(method, endpoint, dict(self.headers), len(body), payload))
+        self.send_json(status, data)
+
+    def send_json(self, status, data, headers=None):
+        content = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(content)
+
+
+class FakeNexusServer:
+    # Serve the Nexus API endpoints on a localhost socket, in a background thread.
+    # Received requests are recorded in `requests`, synced records are kept in `records[entity][id]`,
+    # and faults can be injected with add_fault(), or randomly with `latency` and `error_rate`.
+    def __init__(
+        self,
+        host="127.0.0.1",
+        port=0,
+        token=None,
+        latency=0,
+        error_rate=0,
+        error_statuses=(429, 500, 503),
+        timeout_delay=30,
+        seed=None,
+    ):
+        self.token = token
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_statuses = error_statuses
+        self.timeout_delay = timeout_delay
+        self.path_prefix = "/api/"
+        self.requests = []
+        self.records = {entity: {} for entity in ENTITIES}
+        self.dropdown_statuses = {}
+        self.full_syncs = []
+        self.faults = []
+        self.stopping = threading.Event()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._thread = None
+        self.httpd = ThreadingHTTPServer((host, port), FakeNexusRequestHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.fake_server = self
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}{self.path_prefix}"
+
+    def start(self):
+        # A short poll interval makes stop() quick, which matters for the pytest fixture
+        self._thread = threading.Thread(
+            target=self.httpd.serve_forever, kwargs={"poll_interval": 0.05}, name="fake-nexus-server", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.stopping.set()
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def add_fault(self, **kwargs):
+        fault = Fault(**kwargs)
+        with self._lock:
+            self.faults.append(fault)
+        return fault
+
+    def pop_fault(self, method, endpoint):
+        with self._lock:
+            for fault in self.faults:
+                if fault.matches(method, endpoint):
+                    if fault.times is not None:
+                        fault.times -= 1
+                        if fault.times <= 0:
+                            self.faults.remove(fault)
+                    return fault
+            if self.error_rate and self._random.random() < self.error_rate:
+                return Fault(status=self._random.choice(self.error_statuses), latency=self.latency)
+        if self.latency:
+            return Fault(latency=self.latency)
+        return None
+
+    def record(self, request):
+        with self._lock:
+            self.requests.append(request)
+
+    def requests_to(self, method, endpoint):
+        with self._lock:
+            return [request for request in self.requests if (request.method, request.endpoint) == (method, endpoint)]
+
+    def stats(self):
+        with self._lock:
+            calls = Counter(f"{request.method}:{request.endpoint}" for request in self.requests)
+            return {
+                "calls": dict(calls),
+                "body_bytes": sum(request.body_size for request in self.requests),
+                "records": {entity: len(records) for entity, records in self.records.items()},
+            }
+
+    def check_records(self, payload, fields=None):
+        if not isinstance(payload, list):
+            raise BadRequest("expected a list of records")
+        for record in payload:
+            if not isinstance(record, dict) or not isinstance(record.get("id"), str):
+                raise BadRequest(f"invalid record {record!r}: expected an object with a string id")
+            if fields is not None and record.keys() != fields:
+                raise BadRequest(f"invalid record {record!r}: expected {', '.join(sorted(fields))}")
+
+    def process(self, method, endpoint, payload):
+        if endpoint == "sync-start":
+            started_at = datetime.datetime.now(datetime.UTC).isoformat()
+            with self._lock:
+                self.full_syncs.append({"started_at": started_at, "completed": False})
+            return 200, {"started_at": started_at}
+        if endpoint == "sync-completed":
+            if not isinstance(payload, dict) or not isinstance(payload.get("started_at"), str):
+                raise BadRequest("expected started_at")
+            with self._lock:
+                for full_sync in self.full_syncs:
+                    if full_sync["started_at"] == payload["started_at"]:
+                        full_sync["completed"] = True
+                        return 200, {}
+            raise BadRequest(f"unknown full sync {payload['started_at']}")
+        if endpoint == "dropdown-status":
+            if not isinstance(payload, dict) or not isinstance(payload.get("email"), str):
+                raise BadRequest("expected email")
+            return 200, self.dropdown_statuses.get(payload["email"], {})
+        if method == "POST":
+            self.check_records(payload)
+            with self._lock:
+                self.records[endpoint].update((record["id"], record) for record in payload)
+        else:
+            self.check_records(payload, fields={"id"})
+            with self._lock:
+                for record in payload:
+                    self.records[endpoint].pop(record["id"], None)
+        return 200, {}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a fake Nexus API server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--token", default=None, help="Expected API token, any token is accepted by default")
+    parser.add_argument("--latency", type=float, default=0, help="Seconds to wait before each answer")
+    parser.add_argument("--error-rate", type=float, default=0, help="Ratio of requests answered with an error")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    server = FakeNexusServer(
+        host=args.host,
+        port=args.port,
+        token=args.token,
+        latency=args.latency,
+        error_rate=args.error_rate,
+        seed=args.seed,
+    )
+    print(f"Fake Nexus API listening on {server.base_url}")
+    with server:
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            pass
+    print(json.dumps(server.stats(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+import asyncio
+import contextlib
+import logging
+import threading
+import time
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+
+class AdaptiveConcurrencyLimiter:
+    # AIMD (additive increase, multiplicative decrease) limit of concurrent Nexus requests.
+    # The limit grows by ~1 every `limit` successful requests, and is multiplied by `backoff_ratio`
+    # when Nexus signals an overload (429/503, timeouts) or answers slower than `target_latency`.
+    # A single instance can be shared by every client (and thread) of the process.
+    def __init__(
+        self,
+        initial_limit=4,
+        min_limit=1,
+        max_limit=32,
+        target_latency=5.0,
+        backoff_ratio=0.5,
+        decrease_cooldown=1.0,
+        overload_status=(429, 503),
+    ):
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.target_latency = target_latency
+        self.backoff_ratio = backoff_ratio
+        # Requests sent before a decrease will likely fail too, don't let them collapse the limit
+        self.decrease_cooldown = decrease_cooldown
+        self.overload_status = frozenset(overload_status)
+        self.in_flight = 0
+        self._last_decrease = None
+        self._condition = threading.Condition()
+
+    @property
+    def current_limit(self):
+        return max(int(self.limit), self.min_limit)
+
+    def try_acquire(self):
+        with self._condition:
+            if self.in_flight < self.current_limit:
+                self.in_flight += 1
+                return True
+            return False
+
+    def acquire(self):
+        with self._condition:
+            self._condition.wait_for(lambda: self.in_flight < self.current_limit)
+            self.in_flight += 1
+
+    async def acquire_async(self):
+        # Don't block the event loop on the threading condition
+        while not self.try_acquire():
+            await asyncio.sleep(0.01)
+
+    def release(self):
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify()
+
+    def is_overload(self, exc):
+        if isinstance(exc, httpx.TimeoutException):
+            return True
+        response = getattr(exc, "response", None)
+        return response is not None and response.status_code in self.overload_status
+
+    def on_success(self, latency):
+        if latency > self.target_latency:
+            self.decrease(f"latency={latency:.2f}s")
+            return
+        with self._condition:
+            previous_limit = self.current_limit
+            self.limit = min(self.limit + 1 / self.limit, self.max_limit)
+            if self.current_limit > previous_limit:
+                self._condition.notify_all()
+
+    def decrease(self, reason):
+        with self._condition:
+            now = time.monotonic()
+            if self._last_decrease is not None and now - self._last_decrease < self.decrease_cooldown:
+                return
+            self._last_decrease = now
+            self.limit = max(self.limit * self.backoff_ratio, self.min_limit)
+            limit = self.current_limit
+        logger.warning(
+            "nexus concurrency limit decreased to %d %s",
+            limit,
+            reason,
+            extra={"nexus.concurrency_limit": limit},
+        )
+
+    def on_result(self, latency, exc=None):
+        if exc is None:
+            self.on_success(latency)
+        elif self.is_overload(exc):
+            self.decrease(f"error={exc}")
+
+    @contextlib.contextmanager
+    def track(self):
+        self.acquire()
+        before = time.monotonic()
+        try:
+            yield
+        except Exception as exc:
+            self.on_result(time.monotonic() - before, exc)
+            raise
+        else:
+            self.on_result(time.monotonic() - before)
+        finally:
+            self.release()
+
+    @contextlib.asynccontextmanager
+    async def track_async(self):
+        await self.acquire_async()
+        before = time.monotonic()
+        try:
+            yield
+        except Exception as exc:
+            self.on_result(time.monotonic() - before, exc)
+            raise
+        else:
+            self.on_result(time.monotonic() - before)
+        finally:
+            self.release()
@@ -1,19 +1,75 @@
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from itertools import batched
 
 from django.conf import settings
 from django.core.management.base import BaseCommand
+from django.db import connections
 
-from itoutils.django.nexus.api import NexusAPIClient
+from itoutils.django.nexus.api import NexusAPIClient, RetryPolicy
 
 logger = logging.getLogger(__name__)
 
 
+class LazySerialization:
+    # Serialize objects one by one while the client streams them to Nexus.
+    # Unlike a generator, it can be iterated again if the request is retried.
+    def __init__(self, serializer, objs):
+        self.serializer = serializer
+        self.objs = objs
+
+    def __iter__(self):
+        return map(self.serializer, self.objs)
+
+
+class SendPipeline:
+    # Send batches from worker threads while the next ones are fetched and serialized.
+    # At most `in_flight` batches are being sent or waiting to be sent: submit() blocks until one is done.
+    # After an error, queued batches are dropped and the error is raised by the next submit() or on exit.
+    def __init__(self, in_flight):
+        self.executor = ThreadPoolExecutor(max_workers=in_flight, thread_name_prefix="nexus-full-sync-send")
+        self.slots = threading.BoundedSemaphore(in_flight)
+        self.error = None
+
+    def submit(self, func, *args):
+        self.slots.acquire()
+        if self.error is not None:
+            self.slots.release()
+            raise self.error
+        self.executor.submit(func, *args).add_done_callback(self.done)
+
+    def done(self, future):
+        if not future.cancelled() and (exc := future.exception()) is not None and self.error is None:
+            self.error = exc
+        self.slots.release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.executor.shutdown(wait=True, cancel_futures=exc_type is not None or self.error is not None)
+        if exc_type is None and self.error is not None:
+            raise self.error
+
+
 class BaseNexusFullSyncCommand(BaseCommand):
     CHUNK_SIZE = 5_000
+    # Pipelined mode: number of batches sent to Nexus while the next ones are fetched and serialized.
+    # With 0, each batch is fetched, serialized and sent in turn.
+    IN_FLIGHT_BATCHES = 0
+    # Sync structures, users and memberships concurrently, each in its own thread and database connection.
+    # Within the pipelined mode, the entities share the IN_FLIGHT_BATCHES.
+    PARALLEL_ENTITIES = False
+    # Requires the itoutils.django.nexus.payload_hashes app: only new and changed records are sent, and the
+    # records which aren't synced anymore are deleted. Everything is sent with --full-resend.
+    USE_PAYLOAD_HASHES = False
+    # Serializers return dicts, or NexusPayload records which use less memory and are faster to encode
     structure_serializer = None
     user_serializer = None
     membership_serializer = None
+    # A transient Nexus error shouldn't abort a run that may have lasted several minutes
+    retry_policy = RetryPolicy()
 
     def batched(self, queryset):
         # NB : the iterator allows to fetch data in smaller batches.
@@ -21,43 +77,110 @@ class BaseNexusFullSyncCommand(BaseCommand):
         # query won't affect the batches.
         return batched(queryset.iterator(), self.CHUNK_SIZE)
 
+    pipeline = None
+    payload_hashes = None
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--full-resend",
+            action="store_true",
+            help="Send every record, even those which didn't change since the previous run",
+        )
+
+    def send(self, entity, send_batch, records):
+        if self.payload_hashes is not None:
+            records = self.payload_hashes.filter_changed(entity, records)
+            if not records:
+                return
+        if self.pipeline is None:
+            send_batch(records)
+        else:
+            # Serialized by the thread fetching the objects, since serializers may query the database
+            self.pipeline.submit(send_batch, list(records))
+
+    def get_client(self):
+        # Override to enable other client options, like request compression
+        return NexusAPIClient(retry_policy=self.retry_policy)
+
     def get_structures_queryset(self):
         raise NotImplementedError
 
     def serialize_structures(self, structures):
-        return [self.structure_serializer(structure) for structure in structures]
+        return LazySerialization(self.structure_serializer, structures)
 
     def sync_structures(self):
         for structures in self.batched(self.get_structures_queryset()):
-            self.client.send_structures(self.serialize_structures(structures))
+            self.send("structures", self.client.send_structures, self.serialize_structures(structures))
 
     def get_users_queryset(self):
         raise NotImplementedError
 
     def serialize_users(self, users):
-        return [self.user_serializer(user) for user in users]
+        return LazySerialization(self.user_serializer, users)
 
     def sync_users(self):
         for users in self.batched(self.get_users_queryset()):
-            self.client.send_users(self.serialize_users(users))
+            self.send("users", self.client.send_users, self.serialize_users(users))
 
     def get_memberships_queryset(self):
         raise NotImplementedError
 
     def serialize_memberships(self, memberships):
-        return [self.membership_serializer(structure) for structure in memberships]
+        return LazySerialization(self.membership_serializer, memberships)
 
     def sync_memberships(self):
         for memberships in self.batched(self.get_memberships_queryset()):
-            self.client.send_memberships(self.serialize_memberships(memberships))
+            self.send("memberships", self.client.send_memberships, self.serialize_memberships(memberships))
+
+    def run_sync(self, entity, sync):
+        sync()
+        if self.payload_hashes is not None:
+            # In the thread which serialized the records, see PayloadHashStore
+            self.payload_hashes.mark_missing(entity)
+
+    def run_in_thread(self, entity, sync):
+        try:
+            self.run_sync(entity, sync)
+        finally:
+            connections.close_all()
+
+    def run_syncs(self):
+        syncs = {
+            "structures": self.sync_structures,
+            "users": self.sync_users,
+            "memberships": self.sync_memberships,
+        }
+        if not self.PARALLEL_ENTITIES:
+            for entity, sync in syncs.items():
+                self.run_sync(entity, sync)
+            return
+        with ThreadPoolExecutor(max_workers=len(syncs), thread_name_prefix="nexus-full-sync") as executor:
+            futures = [executor.submit(self.run_in_thread, entity, sync) for entity, sync in syncs.items()]
+        for future in futures:
+            future.result()
 
-    def handle(self, *args, no_checks=False, **kwargs):
+    def handle(self, *args, full_resend=False, no_checks=False, **kwargs):
         if not settings.NEXUS_API_BASE_URL:
             logger.warning("Nexus full sync is disabled")
             return
-        self.client = NexusAPIClient()
-        start_at = self.client.init_full_sync()
-        self.sync_structures()
-        self.sync_users()
-        self.sync_memberships()
-        self.client.complete_full_sync(start_at)
+        self.client = self.get_client()
+        if self.USE_PAYLOAD_HASHES:
+            # Imported here since the payload_hashes app is optional
+            from itoutils.django.nexus.payload_hashes.models import PayloadHashStore
+
+            self.payload_hashes = PayloadHashStore(full_resend=full_resend)
+        # Nexus may drop the records which weren't sent when a full sync is completed: it is only started when
+        # every record is sent. The payload hashes store deletes the missing records explicitly either way.
+        full_sync = self.payload_hashes is None or self.payload_hashes.full_resend
+        if full_sync:
+            start_at = self.client.init_full_sync()
+        if self.IN_FLIGHT_BATCHES:
+            with SendPipeline(self.IN_FLIGHT_BATCHES) as self.pipeline:
+                self.run_syncs()
+        else:
+            self.run_syncs()
+        # Only once every batch was sent
+        if full_sync:
+            self.client.complete_full_sync(start_at)
+        if self.payload_hashes is not None:
+            self.payload_hashes.save(self.client)
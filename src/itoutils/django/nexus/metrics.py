@@ -0,0 +1,18 @@
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+
+class NexusMetricsSink:
+    # Subclass it to forward the Nexus client metrics to statsd, Prometheus...
+    # and reference it in the NEXUS_API_METRICS_SINK setting.
+    def increment(self, name, tags):
+        pass
+
+    def histogram(self, name, value, tags):
+        pass
+
+
+def get_metrics_sink():
+    if sink_path := getattr(settings, "NEXUS_API_METRICS_SINK", None):
+        return import_string(sink_path)()
+    return None
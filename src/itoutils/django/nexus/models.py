@@ -1,25 +1,44 @@
+import collections
 import itertools
-from functools import partial
 
-from django.db import transaction
+from django.core.exceptions import EmptyResultSet
+from django.db import connections, transaction
+from django.db.models import BooleanField, sql
+from django.db.models.deletion import Collector
+from django.db.models.expressions import RawSQL
+from django.db.models.signals import class_prepared, post_delete, pre_delete
+from django.dispatch import receiver
 
 from itoutils.django.models import HasDataChangedMixin
+from itoutils.django.nexus.buffer import defer_nexus_sync, get_sync_buffer
 
 
-class NexusQuerySetMixin:
-    def _sync_or_delete(self, objs):
-        to_sync = []
-        to_delete = []
-        for obj in objs:
-            if obj.should_sync_to_nexus():
-                to_sync.append(obj)
-            else:
-                to_delete.append(obj)
-        if to_sync:
-            transaction.on_commit(partial(self.model.nexus_sync, to_sync))
-        if to_delete:
-            transaction.on_commit(partial(self.model.nexus_delete, [obj.pk for obj in to_delete]))
+class NexusCollector(Collector):
+    # Used by NexusQuerySetMixin.delete(): record_nexus_deletion() alone doesn't prevent fast deletes,
+    # the pks of fast deleted Nexus objects are then fetched with values_list() instead of instances
+    def _has_signal_listeners(self, model):
+        sync_receivers, async_receivers = post_delete._live_receivers(model)
+        return pre_delete.has_listeners(model) or any(
+            receiver is not record_nexus_deletion for receiver in [*sync_receivers, *async_receivers]
+        )
+
+    def delete(self):
+        # Deferred until the deletion is done, since pks are recorded beforehand
+        with defer_nexus_sync(self.using):
+            buffer = get_sync_buffer(self.using)
+            for queryset in self.fast_deletes:
+                if is_synced_by_python(queryset.model):
+                    buffer.add(queryset.model, list(queryset.values_list("pk", flat=True)))
+            # Including the instance deleted without any signal when it is the only one.
+            # Cascaded models without the mixins may be collected too, e.g. when they have receivers.
+            for model, instances in self.data.items():
+                if is_synced_by_python(model):
+                    # Sorted like Collector.delete() does, instances are collected in a set
+                    buffer.add(model, sorted(instance.pk for instance in instances))
+            return super().delete()
 
+
+class NexusQuerySetMixin:
     def _get_nexus_queryset(self):
         # In case should_sync_to_nexus crosses relationships, add a select_related models here
         return self.model.objects
@@ -32,57 +51,207 @@ class NexusQuerySetMixin:
                 updated_fields.add(field.attname)
         return updated_fields
 
+    def _update_returning_pks(self, **kwargs):
+        # Like QuerySet.update(), but returns the updated pks in the same statement (PostgreSQL only).
+        # Returns None when not supported, e.g. for fields of a multi-table inheritance parent.
+        self._for_write = True
+        connection = connections[self.db]
+        if connection.vendor != "postgresql" or self.query.is_sliced or self.query.combinator:
+            return None
+        query = self.query.chain(sql.UpdateQuery)
+        query.add_update_values(kwargs)
+        if query.related_updates:
+            return None
+        # PostgreSQL ignores the ordering of UPDATE statements
+        query.clear_ordering(force=True)
+        query.clear_select_clause()
+        compiler = query.get_compiler(self.db)
+        try:
+            update_sql, params = compiler.as_sql()
+        except EmptyResultSet:
+            return []
+        qn = compiler.quote_name_unless_alias
+        pk_column = f"{qn(self.model._meta.db_table)}.{qn(self.model._meta.pk.column)}"
+        with transaction.mark_for_rollback_on_error(using=self.db), connection.cursor() as cursor:
+            cursor.execute(f"{update_sql} RETURNING {pk_column}", params)
+            pks = [pk for (pk,) in cursor.fetchall()]
+        self._result_cache = None
+        return pks
+
     def update(self, **kwargs):
-        pks_to_sync = []
-        if self.get_updated_fields(kwargs.keys()) & set(self.model.nexus_tracked_fields):
+        changed_fields = self.get_updated_fields(kwargs.keys()) & set(self.model.nexus_tracked_fields)
+        if not changed_fields or self.model.nexus_use_triggers:
+            return super().update(**kwargs)
+        pks_to_sync = self._update_returning_pks(**kwargs)
+        if pks_to_sync is None:
             pks_to_sync = list(self.values_list("pk", flat=True))
-        result = super().update(**kwargs)
+            result = super().update(**kwargs)
+        else:
+            result = len(pks_to_sync)
         if pks_to_sync:
-            for batch in itertools.batched(self._get_nexus_queryset().filter(pk__in=pks_to_sync), 10_000):
-                self._sync_or_delete(batch)
+            # Synced or deleted on commit, depending on should_sync_to_nexus
+            get_sync_buffer(self.db).add(self.model, pks_to_sync, fields=frozenset(changed_fields))
         return result
 
     def delete(self):
-        transaction.on_commit(partial(self.model.nexus_delete, list(self.values_list("pk", flat=True))))
-        return super().delete()
+        # Like QuerySet.delete(), with a NexusCollector: the deleted objects of this model and the cascaded
+        # ones are fast deleted when possible, and handed over to the buffer once per model after the deletion
+        self._not_support_combined_queries("delete")
+        if self.query.is_sliced:
+            raise TypeError("Cannot use 'limit' or 'offset' with delete().")
+        if self.query.distinct_fields:
+            raise TypeError("Cannot call delete() after .distinct(*fields).")
+        if self._fields is not None:
+            raise TypeError("Cannot call delete() after .values() or .values_list()")
+        del_query = self._chain()
+        del_query._for_write = True
+        del_query.query.select_for_update = False
+        del_query.query.select_related = False
+        del_query.query.clear_ordering(force=True)
+        collector = NexusCollector(using=del_query.db, origin=self)
+        collector.collect(del_query)
+        result = collector.delete()
+        self._result_cache = None
+        return result
+
+    delete.alters_data = True
+    delete.queryset_only = True
+
+    def delete_in_chunks(self, chunk_size=10_000):
+        # Delete by pk-ordered chunks, to delete millions of rows without loading all their pks.
+        # Outside of a transaction each chunk is committed, and sent to Nexus, before the next one.
+        # In a transaction, pks are kept until commit unless the model uses the outbox.
+        deleted = 0
+        rows_count = collections.Counter()
+        last_pk = None
+        while True:
+            queryset = self.order_by("pk")
+            if last_pk is not None:
+                queryset = queryset.filter(pk__gt=last_pk)
+            with transaction.atomic(using=self.db):
+                pks = list(queryset.values_list("pk", flat=True)[:chunk_size])
+                if not pks:
+                    break
+                chunk_deleted, chunk_rows_count = self.filter(pk__in=pks).delete()
+            deleted += chunk_deleted
+            rows_count.update(chunk_rows_count)
+            last_pk = pks[-1]
+        return deleted, dict(rows_count)
 
     # bulk_update calls update so it's correctly handled (see the tests)
 
+    def _get_inserted_pks(self, pks):
+        # Rows inserted by the current transaction have xmax = 0, while the rows updated by
+        # INSERT ... ON CONFLICT DO UPDATE are locked by it (PostgreSQL only).
+        if connections[self.db].vendor != "postgresql":
+            return pks
+        xmax = f"{connections[self.db].ops.quote_name(self.model._meta.db_table)}.xmax"
+        inserted_pks = []
+        for batch in itertools.batched(pks, 10_000):
+            inserted_pks += (
+                self.model._base_manager.using(self.db)
+                .filter(pk__in=batch)
+                .alias(inserted=RawSQL(f"{xmax} = 0", (), output_field=BooleanField()))
+                .filter(inserted=True)
+                .values_list("pk", flat=True)
+            )
+        return inserted_pks
+
     def bulk_create(
         self,
         objs,
         *args,
         ignore_conflicts=False,
         update_conflicts=False,
+        update_fields=None,
         **kwargs,
     ):
-        if ignore_conflicts is False and update_conflicts is False:
-            # We don't want to handle this method if conflicts are ignored or updated
-            created_objs = super().bulk_create(objs, *args, **kwargs)
-            transaction.on_commit(partial(self.model.nexus_sync, created_objs))
-            return created_objs
-        raise NotImplementedError
+        if self.model.nexus_use_triggers:
+            return super().bulk_create(
+                objs,
+                *args,
+                ignore_conflicts=ignore_conflicts,
+                update_conflicts=update_conflicts,
+                update_fields=update_fields,
+                **kwargs,
+            )
+        if ignore_conflicts:
+            # Ignored rows are not returned, nor are the pks of the inserted ones
+            raise NotImplementedError
+        if update_conflicts and not connections[self.db].features.can_return_rows_from_bulk_insert:
+            raise NotImplementedError
+        # xmax is only reliable in the inserting transaction: afterwards, a lock taken by another transaction
+        # (e.g. FOR KEY SHARE when a related row is inserted) sets it on inserted rows too
+        with transaction.atomic(using=self.db):
+            created_objs = super().bulk_create(
+                objs, *args, update_conflicts=update_conflicts, update_fields=update_fields, **kwargs
+            )
+            pks = [obj.pk for obj in created_objs]
+            if update_conflicts and not self.get_updated_fields(update_fields) & set(self.model.nexus_tracked_fields):
+                # Updated rows don't need to be synced, only the inserted ones
+                pks = self._get_inserted_pks(pks)
+        if pks:
+            get_sync_buffer(self.db).add(self.model, pks)
+        return created_objs
 
 
 class NexusModelMixin(HasDataChangedMixin):
     nexus_tracked_fields = None
     nexus_sync = None
     nexus_delete = None
+    # Optional Q equivalent to should_sync_to_nexus(), to pick the objects to sync in SQL: objects to delete
+    # are neither fetched nor instantiated, and relations used by the predicate don't need a select_related
+    nexus_sync_condition = None
+    # Optional partial updates: when only nexus_partial_fields changed, nexus_partial_sync is called
+    # with (obj, changed_fields) pairs instead of calling nexus_sync with the objects.
+    # They must not include the fields read by should_sync_to_nexus(): their changes may add the object
+    # to Nexus, which requires a full sync. Fields used by nexus_sync_condition are ignored here.
+    nexus_partial_fields = None
+    nexus_partial_sync = None
+    # Requires the itoutils.django.nexus.outbox app, see drain_nexus_outbox
+    nexus_use_outbox = False
+    # Send the changes from background threads after commit, see NexusDispatcher
+    nexus_use_dispatcher = False
+    # Changes are captured by database triggers writing to the outbox, see CreateNexusTriggers:
+    # the Python hooks are skipped
+    nexus_use_triggers = False
 
     def should_sync_to_nexus(self):
         raise NotImplementedError
 
     def save(self, *args, **kwargs):
-        sync_needed = self.has_data_changed(self.nexus_tracked_fields)
+        if self.nexus_use_triggers:
+            return super().save(*args, **kwargs)
+        adding = self._state.adding
+        changed_fields = self.get_changed_fields(self.nexus_tracked_fields)
 
         super().save(*args, **kwargs)
 
-        if sync_needed:
-            if self.should_sync_to_nexus():
-                transaction.on_commit(partial(self.nexus_sync, [self]))
-            else:
-                transaction.on_commit(partial(self.nexus_delete, [self.pk]))
+        if changed_fields:
+            # Changes of the transaction are sent in a single call per model on commit
+            get_sync_buffer(self._state.db).add(
+                self.__class__, [self.pk], fields=None if adding else frozenset(changed_fields)
+            )
 
     def delete(self, *args, **kwargs):
-        transaction.on_commit(partial(self.nexus_delete, [self.pk]))
-        return super().delete(*args, **kwargs)
+        with defer_nexus_sync(kwargs.get("using") or self._state.db):
+            return super().delete(*args, **kwargs)
+
+
+def is_synced_by_python(model):
+    return issubclass(model, NexusModelMixin) and not model.nexus_use_triggers
+
+
+def record_nexus_deletion(sender, instance, using, **kwargs):
+    # Sent for every deleted object, even when the deletion cascades from a model without the mixins.
+    # Only NexusQuerySetMixin.delete() keeps fast deleting these models, see NexusCollector
+    get_sync_buffer(using).add(sender, [instance.pk])
+
+
+@receiver(class_prepared)
+def connect_nexus_deletion_receiver(sender, **kwargs):
+    # Connected per model rather than for all senders: it disables the fast deletes of these models only,
+    # so that the deletion collector sends post_delete for the rows it would otherwise delete in bulk.
+    # Django then only loads the pk and foreign keys of the cascaded objects.
+    if is_synced_by_python(sender) and not sender._meta.abstract:
+        post_delete.connect(record_nexus_deletion, sender=sender, dispatch_uid=f"nexus_deletion_{sender._meta.label}")
@@ -0,0 +1,9 @@
+from django.apps import AppConfig
+
+
+class NexusOutboxConfig(AppConfig):
+    # Store the Nexus changes in a table, in the same transaction as the changes themselves,
+    # instead of calling Nexus on commit. The drain_nexus_outbox command sends them in large batches.
+    name = "itoutils.django.nexus.outbox"
+    label = "nexus_outbox"
+    verbose_name = "Nexus outbox"
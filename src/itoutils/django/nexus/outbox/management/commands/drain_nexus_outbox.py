@@ -0,0 +1,98 @@
+import time
+from itertools import groupby
+
+from django.apps import apps
+from django.core.management import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import F
+
+from itoutils.django.commands import LoggedCommandMixin
+from itoutils.django.nexus.buffer import sync_or_delete
+from itoutils.django.nexus.outbox.models import OutboxEntry
+
+
+class Command(LoggedCommandMixin, BaseCommand):
+    help = "Send the changes stored in the Nexus outbox. Several workers can run in parallel."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=5_000)
+        parser.add_argument(
+            "--loop",
+            action="store_true",
+            help="Keep waiting for new entries instead of stopping when the outbox is empty",
+        )
+        parser.add_argument("--sleep", type=float, default=5, help="Seconds to wait when the outbox is empty")
+        parser.add_argument(
+            "--max-attempts",
+            type=int,
+            default=5,
+            help="Entries which failed this many times are not sent anymore",
+        )
+        parser.add_argument(
+            "--retry-failed",
+            action="store_true",
+            help="Send again the entries which reached --max-attempts",
+        )
+
+    def drain_model_entries(self, model_label, entries, max_attempts):
+        # Returns whether the entries were sent: each model is sent, or fails, on its own
+        entry_pks = [pk for pk, _, _ in entries]
+        try:
+            model = apps.get_model(model_label)
+        except LookupError:
+            # Retrying won't help
+            self.logger.error("Unknown model %s in %d Nexus outbox entries", model_label, len(entries))
+            OutboxEntry.objects.filter(pk__in=entry_pks).update(attempts=max_attempts)
+            return False
+        to_python = model._meta.pk.to_python
+        try:
+            with transaction.atomic():
+                sync_or_delete(model, list(dict.fromkeys(to_python(object_pk) for _, _, object_pk in entries)))
+        except Exception:
+            # Kept for the next runs, until max_attempts
+            self.logger.exception("Failed to send %d Nexus outbox entries of %s", len(entries), model_label)
+            OutboxEntry.objects.filter(pk__in=entry_pks).update(attempts=F("attempts") + 1)
+            return False
+        OutboxEntry.objects.filter(pk__in=entry_pks).delete()
+        return True
+
+    def drain_batch(self, batch_size, max_attempts, last_pk=None):
+        # Returns the number of fetched entries, the number of failed ones and the last fetched pk
+        with transaction.atomic():
+            queryset = OutboxEntry.objects.filter(attempts__lt=max_attempts)
+            if last_pk is not None:
+                # Entries which failed during this run are only retried by the next one
+                queryset = queryset.filter(pk__gt=last_pk)
+            # Entries locked by another worker are skipped: they are being sent
+            entries = list(
+                queryset.select_for_update(skip_locked=True)
+                .order_by("pk")
+                .values_list("pk", "model", "object_pk")[:batch_size]
+            )
+            if not entries:
+                return 0, 0, last_pk
+            failed = 0
+            for model_label, model_entries in groupby(sorted(entries, key=lambda e: e[1]), key=lambda e: e[1]):
+                model_entries = list(model_entries)
+                if not self.drain_model_entries(model_label, model_entries, max_attempts):
+                    failed += len(model_entries)
+        if sent := len(entries) - failed:
+            self.logger.info("Sent %d Nexus outbox entries", sent)
+        return len(entries), failed, entries[-1][0]
+
+    def handle(self, *args, batch_size, loop, sleep, max_attempts, retry_failed, **options):
+        if retry_failed:
+            OutboxEntry.objects.filter(attempts__gte=max_attempts).update(attempts=0)
+        failed = 0
+        last_pk = None
+        while True:
+            fetched, batch_failed, last_pk = self.drain_batch(batch_size, max_attempts, last_pk)
+            failed += batch_failed
+            if fetched == batch_size:
+                continue
+            if not loop:
+                break
+            last_pk = None
+            time.sleep(sleep)
+        if failed:
+            raise CommandError(f"Failed to send {failed} Nexus outbox entries")
@@ -0,0 +1,24 @@
+from django.db import models
+from django.utils import timezone
+
+
+class OutboxEntryManager(models.Manager):
+    def add(self, model, pks, using=None):
+        model_label = model._meta.label_lower
+        self.db_manager(using).bulk_create(self.model(model=model_label, object_pk=str(pk)) for pk in pks)
+
+
+class OutboxEntry(models.Model):
+    # An object to sync or delete: drain_nexus_outbox decides depending on its state when the entry is sent
+    id = models.BigAutoField(primary_key=True)
+    model = models.CharField(max_length=255)
+    object_pk = models.CharField(max_length=255)
+    created_at = models.DateTimeField(default=timezone.now)
+    # Failed sends: drain_nexus_outbox stops retrying after --max-attempts, the entry is then a dead letter.
+    # A database default since the entries are also written by the triggers, see CreateNexusTriggers
+    attempts = models.PositiveIntegerField(default=0, db_default=0)
+
+    objects = OutboxEntryManager()
+
+    def __str__(self):
+        return f"{self.model}:{self.object_pk}"
@@ -0,0 +1,80 @@
+from django.db.migrations.operations.base import Operation
+
+from itoutils.django.nexus.outbox.models import OutboxEntry
+
+
+class CreateNexusTriggers(Operation):
+    # Capture the changes of a model with PostgreSQL triggers writing to the outbox table, for models
+    # with nexus_use_triggers: raw SQL, cascades and every kind of update are captured, without Python code.
+    # fields are the model's nexus_tracked_fields, at the time of the migration: add a new migration
+    # (dropping and recreating the triggers) when they change.
+    # The migration must depend on ("nexus_outbox", "0001_initial"), which creates the outbox table with the
+    # database defaults the triggers rely on (attempts). Other database backends are ignored.
+    reversible = True
+
+    def __init__(self, model_name, fields):
+        self.model_name = model_name
+        self.fields = fields
+
+    def deconstruct(self):
+        return self.__class__.__name__, [], {"model_name": self.model_name, "fields": self.fields}
+
+    def state_forwards(self, app_label, state):
+        pass
+
+    def get_names(self, model):
+        table = model._meta.db_table
+        return f"{table}_nexus_outbox", f"{table}_nexus_outbox_insert_delete", f"{table}_nexus_outbox_update"
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor != "postgresql":
+            return
+        model = to_state.apps.get_model(app_label, self.model_name)
+        qn = schema_editor.quote_name
+        function, insert_delete_trigger, update_trigger = self.get_names(model)
+        table = qn(model._meta.db_table)
+        pk = qn(model._meta.pk.column)
+        columns = [qn(model._meta.get_field(field).column) for field in self.fields]
+        label = schema_editor.quote_value(model._meta.label_lower)
+        # The drainer decides to sync or delete depending on the object state, only the pk is stored
+        schema_editor.execute(
+            f"""
+            CREATE OR REPLACE FUNCTION {qn(function)}() RETURNS trigger AS $$
+            BEGIN
+                INSERT INTO {qn(OutboxEntry._meta.db_table)} (model, object_pk, created_at)
+                VALUES ({label}, (CASE WHEN TG_OP = 'DELETE' THEN OLD.{pk} ELSE NEW.{pk} END)::text, now());
+                RETURN NULL;
+            END
+            $$ LANGUAGE plpgsql
+            """
+        )
+        schema_editor.execute(
+            f"CREATE TRIGGER {qn(insert_delete_trigger)} AFTER INSERT OR DELETE ON {table} "
+            f"FOR EACH ROW EXECUTE FUNCTION {qn(function)}()"
+        )
+        if columns:
+            # Only when a tracked column actually changes
+            old = ", ".join(f"OLD.{column}" for column in columns)
+            new = ", ".join(f"NEW.{column}" for column in columns)
+            schema_editor.execute(
+                f"CREATE TRIGGER {qn(update_trigger)} AFTER UPDATE OF {', '.join(columns)} ON {table} "
+                f"FOR EACH ROW WHEN ((ROW({old})) IS DISTINCT FROM (ROW({new}))) EXECUTE FUNCTION {qn(function)}()"
+            )
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor != "postgresql":
+            return
+        model = from_state.apps.get_model(app_label, self.model_name)
+        qn = schema_editor.quote_name
+        function, insert_delete_trigger, update_trigger = self.get_names(model)
+        table = qn(model._meta.db_table)
+        schema_editor.execute(f"DROP TRIGGER IF EXISTS {qn(update_trigger)} ON {table}")
+        schema_editor.execute(f"DROP TRIGGER IF EXISTS {qn(insert_delete_trigger)} ON {table}")
+        schema_editor.execute(f"DROP FUNCTION IF EXISTS {qn(function)}()")
+
+    def describe(self):
+        return f"Create the Nexus outbox triggers of {self.model_name}"
+
+    @property
+    def migration_name_fragment(self):
+        return f"{self.model_name.lower()}_nexus_triggers"
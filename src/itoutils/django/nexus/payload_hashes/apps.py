@@ -0,0 +1,9 @@
+from django.apps import AppConfig
+
+
+class NexusPayloadHashesConfig(AppConfig):
+    # Remember what the full sync sent to Nexus, so that the next runs only send the records that changed.
+    # See BaseNexusFullSyncCommand.USE_PAYLOAD_HASHES
+    name = "itoutils.django.nexus.payload_hashes"
+    label = "nexus_payload_hashes"
+    verbose_name = "Nexus payload hashes"
@@ -0,0 +1,28 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    initial = True
+
+    dependencies = []
+
+    operations = [
+        migrations.CreateModel(
+            name="PayloadHash",
+            fields=[
+                ("id", models.BigAutoField(primary_key=True, serialize=False)),
+                ("entity", models.CharField(max_length=32)),
+                ("object_id", models.CharField(max_length=255)),
+                ("payload_hash", models.CharField(max_length=32)),
+                ("sent_at", models.DateTimeField(null=True)),
+                ("run_id", models.UUIDField(null=True)),
+                ("pending_hash", models.CharField(blank=True, max_length=32)),
+                ("missing_run_id", models.UUIDField(null=True)),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(fields=("entity", "object_id"), name="nexus_payload_hash_unique")
+                ],
+            },
+        ),
+    ]
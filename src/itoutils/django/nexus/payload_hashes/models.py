@@ -0,0 +1,144 @@
+import hashlib
+import uuid
+
+from django.db import connection, models
+from django.db.models import F
+from django.db.models.expressions import RawSQL
+from django.utils import timezone
+
+from itoutils.django.nexus.api import encode_json
+
+ENTITIES = ("structures", "users", "memberships")
+BATCH_SIZE = 5_000
+
+
+def get_record_id(record):
+    return record["id"] if isinstance(record, dict) else record.id
+
+
+def hash_record(record):
+    return hashlib.blake2b(encode_json(record), digest_size=16).hexdigest()
+
+
+class PayloadHash(models.Model):
+    # The hash of the last record sent to Nexus by the full sync, by entity ("users", ...) and Nexus id
+    id = models.BigAutoField(primary_key=True)
+    entity = models.CharField(max_length=32)
+    object_id = models.CharField(max_length=255)
+    # Empty until a run sending the record succeeded
+    payload_hash = models.CharField(max_length=32)
+    sent_at = models.DateTimeField(null=True)
+    # Set by a run which serialized a new or changed record: pending_hash becomes payload_hash once
+    # the run succeeded
+    run_id = models.UUIDField(null=True)
+    pending_hash = models.CharField(max_length=32, blank=True)
+    # Set by a run which didn't serialize the record: it is deleted from Nexus once the run succeeded
+    missing_run_id = models.UUIDField(null=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["entity", "object_id"], name="nexus_payload_hash_unique"),
+        ]
+
+    def __str__(self):
+        return f"{self.entity}:{self.object_id}"
+
+
+class PayloadHashStore:
+    # Used by BaseNexusFullSyncCommand during a single run (PostgreSQL only): filter_changed() drops the
+    # records sent unchanged by a previous run, mark_missing() flags the records which weren't serialized,
+    # and save() deletes them and stores the new hashes once every record was sent.
+    # Only new, changed and missing records are written to the table. The ids of the serialized records are
+    # kept in a temporary table of the connection: filter_changed() and mark_missing() of an entity must be
+    # called from the same thread.
+    # Without stored hashes (e.g. on the first run), or with full_resend, every record is sent.
+    def __init__(self, full_resend=False):
+        self.full_resend = full_resend or not PayloadHash.objects.filter(sent_at__isnull=False).exists()
+        self.run_id = uuid.uuid4()
+        self.seen_entities = set()
+
+    def get_seen_table(self, entity):
+        return connection.ops.quote_name(f"nexus_payload_hash_seen_{entity}")
+
+    def record_seen(self, entity, object_ids):
+        table = self.get_seen_table(entity)
+        with connection.cursor() as cursor:
+            if entity not in self.seen_entities:
+                # The table may be left over by an interrupted run on the same connection
+                cursor.execute(f"DROP TABLE IF EXISTS pg_temp.{table}")
+                cursor.execute(f"CREATE TEMPORARY TABLE {table} (object_id varchar(255) PRIMARY KEY)")
+                self.seen_entities.add(entity)
+            cursor.executemany(
+                f"INSERT INTO pg_temp.{table} (object_id) VALUES (%s) ON CONFLICT DO NOTHING",
+                [(object_id,) for object_id in object_ids],
+            )
+
+    def filter_changed(self, entity, records):
+        hashed_records = [(record, get_record_id(record), hash_record(record)) for record in records]
+        self.record_seen(entity, [object_id for _, object_id, _ in hashed_records])
+        stored_hashes = dict(
+            PayloadHash.objects.filter(
+                entity=entity, object_id__in=[object_id for _, object_id, _ in hashed_records]
+            ).values_list("object_id", "payload_hash")
+        )
+        changed = [
+            (record, object_id, payload_hash)
+            for record, object_id, payload_hash in hashed_records
+            if stored_hashes.get(object_id) != payload_hash
+        ]
+        # Only promoted to payload_hash by save(): an interrupted run doesn't prevent the next one from
+        # sending them
+        PayloadHash.objects.bulk_create(
+            (
+                PayloadHash(
+                    entity=entity,
+                    object_id=object_id,
+                    payload_hash="",
+                    run_id=self.run_id,
+                    pending_hash=payload_hash,
+                )
+                for _, object_id, payload_hash in changed
+            ),
+            batch_size=BATCH_SIZE,
+            update_conflicts=True,
+            unique_fields=["entity", "object_id"],
+            update_fields=["run_id", "pending_hash"],
+        )
+        if self.full_resend:
+            # Sent anyway, only the changed hashes are written
+            return [record for record, _, _ in hashed_records]
+        return [record for record, _, _ in changed]
+
+    def mark_missing(self, entity):
+        # Once every record of the entity was serialized
+        missing = PayloadHash.objects.filter(entity=entity)
+        if entity in self.seen_entities:
+            table = self.get_seen_table(entity)
+            missing = missing.alias(
+                seen=RawSQL(
+                    f"EXISTS (SELECT 1 FROM pg_temp.{table} seen "
+                    f"WHERE seen.object_id = {connection.ops.quote_name(PayloadHash._meta.db_table)}.object_id)",
+                    (),
+                    output_field=models.BooleanField(),
+                )
+            ).filter(seen=False)
+        missing.update(missing_run_id=self.run_id)
+        if entity in self.seen_entities:
+            with connection.cursor() as cursor:
+                cursor.execute(f"DROP TABLE pg_temp.{self.get_seen_table(entity)}")
+            self.seen_entities.discard(entity)
+
+    def delete_missing(self, client, entity):
+        # Deleted explicitly, even after a full resend: the store doesn't depend on what Nexus does when
+        # a full sync is completed
+        missing = PayloadHash.objects.filter(entity=entity, missing_run_id=self.run_id).order_by("pk")
+        while missing_rows := list(missing.values_list("pk", "object_id")[:BATCH_SIZE]):
+            getattr(client, f"delete_{entity}")([object_id for _, object_id in missing_rows])
+            PayloadHash.objects.filter(pk__in=[pk for pk, _ in missing_rows]).delete()
+
+    def save(self, client):
+        for entity in ENTITIES:
+            self.delete_missing(client, entity)
+        PayloadHash.objects.filter(run_id=self.run_id).update(
+            payload_hash=F("pending_hash"), pending_hash="", run_id=None, sent_at=timezone.now()
+        )
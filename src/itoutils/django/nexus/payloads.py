@@ -0,0 +1,97 @@
+import dataclasses
+import json
+from json.encoder import encode_basestring
+
+# Same options as httpx, see api.encode_json()
+_encoder = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"), allow_nan=False)
+
+
+def _encode_value(value):
+    if value is None:
+        return "null"
+    if value is True:
+        return "true"
+    if value is False:
+        return "false"
+    if value.__class__ is int:
+        return int.__repr__(value)
+    return _encoder.encode(value)
+
+
+class NexusPayload:
+    # Base class of the records sent to Nexus: they use less memory than dicts and are encoded
+    # to the exact same JSON, several times faster, by NexusAPIClient.
+    __slots__ = ()
+
+    @classmethod
+    def get_json_encoder(cls):
+        if (encoder := cls.__dict__.get("_json_encoder")) is None:
+            encoder = cls._json_encoder = cls._build_json_encoder()
+        return encoder
+
+    @classmethod
+    def _build_json_encoder(cls):
+        # Like dataclasses, generate the function once per class: it avoids building an intermediate dict
+        # and a loop over the fields, and most values are strings which are encoded inline.
+        parts = []
+        for i, field in enumerate(dataclasses.fields(cls)):
+            key = ("{" if i == 0 else ",") + encode_basestring(field.name) + ":"
+            value = f"obj.{field.name}"
+            parts.append(f"{key!r} + (s({value}) if {value}.__class__ is str else e({value}))")
+        source = f"def encode(obj):\n    return ({' + '.join(parts)} + '}}').encode()\n"
+        namespace = {"s": encode_basestring, "e": _encode_value}
+        exec(source, namespace)
+        return namespace["encode"]
+
+    def encode_json(self):
+        return self.get_json_encoder()(self)
+
+    def to_dict(self):
+        return dataclasses.asdict(self)
+
+    def to_partial_dict(self, fields):
+        # Partial record, for nexus_partial_sync: sent through the same endpoints as full records
+        # (e.g. NexusAPIClient.send_users()). Nexus must then keep the fields missing from the record,
+        # check it before enabling nexus_partial_fields.
+        return {"id": self.id, **{field: getattr(self, field) for field in fields}}
+
+
+@dataclasses.dataclass(slots=True, kw_only=True)
+class NexusUser(NexusPayload):
+    id: str
+    kind: str | None = None
+    first_name: str | None = None
+    last_name: str | None = None
+    email: str | None = None
+    phone: str | None = None
+    last_login: str | None = None
+    auth: str | None = None
+    department: str | None = None
+
+
+@dataclasses.dataclass(slots=True, kw_only=True)
+class NexusStructure(NexusPayload):
+    id: str
+    kind: str | None = None
+    siret: str | None = None
+    name: str | None = None
+    phone: str | None = None
+    email: str | None = None
+    address_line_1: str | None = None
+    address_line_2: str | None = None
+    post_code: str | None = None
+    city: str | None = None
+    department: str | None = None
+    accessibility: str | None = None
+    description: str | None = None
+    opening_hours: str | None = None
+    source_link: str | None = None
+    website: str | None = None
+
+
+@dataclasses.dataclass(slots=True, kw_only=True)
+class NexusMembership(NexusPayload):
+    id: str
+    user_id: str
+    structure_id: str
+    role: str | None = None
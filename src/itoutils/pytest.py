@@ -8,6 +8,9 @@ import pytest
 from django.conf import settings as django_settings
 from django.utils import timezone
 
+from itoutils.django.nexus.circuit_breaker import reset_circuit_breaker
+from itoutils.django.nexus.fake_server import FakeNexusServer
+
 
 @pytest.fixture
 def capture_stream_handler_log(request):
@@ -36,6 +39,8 @@ def nexus_url(endpoint):
 
 @pytest.fixture
 def mock_nexus_api(respx_mock, settings):
+    # Failures of the previous tests must not open the shared circuit breaker
+    reset_circuit_breaker()
     settings.NEXUS_API_BASE_URL = "http://nexus/api/"
     settings.NEXUS_API_TOKEN = "very-secret-token"
     respx_mock.post(nexus_url("sync-start")).respond(200, json={"started_at": timezone.now().isoformat()})
@@ -48,3 +53,13 @@ def mock_nexus_api(respx_mock, settings):
     respx_mock.post(nexus_url("sync-completed")).respond(200, json={})
     respx_mock.post(nexus_url("dropdown-status")).respond(200, json={})
     return respx_mock
+
+
+@pytest.fixture
+def fake_nexus_server(settings):
+    # A real HTTP server, see FakeNexusServer to inspect received requests and inject faults
+    reset_circuit_breaker()
+    with FakeNexusServer(token="very-secret-token") as server:
+        settings.NEXUS_API_BASE_URL = server.base_url
+        settings.NEXUS_API_TOKEN = server.token
+        yield server
@@ -22,6 +22,8 @@ INSTALLED_APPS = [
     # First party
     "itoutils.django",
     "itoutils.django.decoupage_administratif",
+    "itoutils.django.nexus.outbox",
+    "itoutils.django.nexus.payload_hashes",
     # First party's tests
     "testproject.testapp",
 ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:48
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("testapp", "0003_synceditem"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SyncedItemNote",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("text", models.CharField()),
+                (
+                    "item",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE, related_name="notes", to="testapp.synceditem"
+                    ),
+                ),
+            ],
+        ),
+    ]
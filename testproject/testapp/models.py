@@ -39,3 +39,9 @@ class SyncedItem(NexusModelMixin, models.Model):
         return self.sync_me and self.user.is_active
 
     objects = models.Manager.from_queryset(SyncedItemQuerySet)()
+
+
+class SyncedItemNote(models.Model):
+    # Not synced to Nexus, deleted with its item
+    item = models.ForeignKey(SyncedItem, on_delete=models.CASCADE, related_name="notes")
+    text = models.CharField()
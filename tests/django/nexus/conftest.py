@@ -0,0 +1,10 @@
+import pytest
+
+from testproject.testapp.models import SyncedItem
+
+
+@pytest.fixture(name="mock_synced_item")
+def mock_synced_item_fixture(request, mocker):
+    # Sets mocked_sync and mocked_delete on the test class instance
+    request.instance.mocked_sync = mocker.patch.object(SyncedItem, "nexus_sync")
+    request.instance.mocked_delete = mocker.patch.object(SyncedItem, "nexus_delete")
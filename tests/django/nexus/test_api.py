@@ -1,9 +1,27 @@
+import asyncio
+import gzip
 import json
+import logging
+import os
+from unittest import mock
 
 import httpx
 import pytest
+import time_machine
+from django.core.exceptions import ImproperlyConfigured
 
-from itoutils.django.nexus.api import NexusAPIClient, NexusAPIException
+from itoutils.django.nexus.api import (
+    COMPRESSORS,
+    AsyncNexusAPIClient,
+    JSONArrayStream,
+    NexusAPIClient,
+    NexusAPIException,
+    RetryPolicy,
+    close_shared_transport,
+    get_shared_transport,
+)
+from itoutils.django.nexus.management.base_full_sync import LazySerialization
+from itoutils.django.nexus.metrics import NexusMetricsSink
 from itoutils.pytest import nexus_url
 
 
@@ -87,6 +105,7 @@ class TestClient:
         self.client.send_structures(self.dummy_send_payload)
         assert caplog.messages == [
             'HTTP Request: POST http://nexus/api/structures "HTTP/1.1 200 OK"',
+            "nexus POST:structures status=200",
             "nexus POST:structures error={'my-id': {'post_code': ['Ce champ ne peut être vide.']}}",
         ]
 
@@ -98,6 +117,7 @@ class TestClient:
             self.client.complete_full_sync("bad start_at")
         assert caplog.messages == [
             'HTTP Request: POST http://nexus/api/sync-completed "HTTP/1.1 400 Bad Request"',
+            "nexus POST:sync-completed status=400",
             "nexus POST:sync-completed error={'errors': {'started_at': ['Ce champ est obligatoire.']}}",
         ]
 
@@ -107,6 +127,7 @@ class TestClient:
             self.client.complete_full_sync("bad start_at")
         assert caplog.messages == [
             'HTTP Request: POST http://nexus/api/sync-completed "HTTP/1.1 503 Service Unavailable"',
+            "nexus POST:sync-completed status=503",
             "nexus POST:sync-completed error=Server error '503 Service Unavailable' "
             "for url 'http://nexus/api/sync-completed'\n"
             "For more information check: "
@@ -121,9 +142,10 @@ class TestClient:
             self.client.send_structures(self.dummy_send_payload)
         assert isinstance(exc_info.value.__cause__, httpx.ConnectError)
         assert caplog.messages == [
+            "nexus POST:structures status=ConnectError",
             "nexus POST:structures error=[Errno 111] Connection refused",
         ]
-        [record] = [r for r in caplog.records if r.name == "itoutils.django.nexus.api"]
+        [_metrics_record, record] = [r for r in caplog.records if r.name == "itoutils.django.nexus.api"]
         assert record.exc_info[0] is httpx.ConnectError
 
     def test_read_timeout(self, mock_nexus_api, caplog):
@@ -134,7 +156,559 @@ class TestClient:
             self.client.send_structures(self.dummy_send_payload)
         assert isinstance(exc_info.value.__cause__, httpx.ReadTimeout)
         assert caplog.messages == [
+            "nexus POST:structures status=ReadTimeout",
             "nexus POST:structures error=The read operation timed out",
         ]
-        [record] = [r for r in caplog.records if r.name == "itoutils.django.nexus.api"]
+        [_metrics_record, record] = [r for r in caplog.records if r.name == "itoutils.django.nexus.api"]
         assert record.exc_info[0] is httpx.ReadTimeout
+
+
+class TestAsyncClient:
+    @pytest.fixture(autouse=True)
+    def setup_method(self, mock_nexus_api):
+        self.dummy_send_payload = {"key": "value"}
+        self.dummy_pks = ["a", "b"]
+        self.dummy_pks_payload = [{"id": "a"}, {"id": "b"}]
+
+    def run(self, method_name, *args):
+        async def _run():
+            async with AsyncNexusAPIClient() as client:
+                return await getattr(client, method_name)(*args)
+
+        return asyncio.run(_run())
+
+    def test_init_full_sync(self, mock_nexus_api):
+        started_at = self.run("init_full_sync")
+        [call] = mock_nexus_api.calls
+        assert call.request.method == "POST"
+        assert call.request.url == "http://nexus/api/sync-start"
+        assert started_at == call.response.json()["started_at"]
+
+    @pytest.mark.parametrize("endpoint", ["users", "structures", "memberships"])
+    def test_send(self, mock_nexus_api, endpoint):
+        self.run(f"send_{endpoint}", self.dummy_send_payload)
+        [call] = mock_nexus_api.calls
+        assert call.request.method == "POST"
+        assert call.request.url == f"http://nexus/api/{endpoint}"
+        assert json.loads(call.request.content.decode()) == self.dummy_send_payload
+
+    @pytest.mark.parametrize("endpoint", ["users", "structures", "memberships"])
+    def test_delete(self, mock_nexus_api, endpoint):
+        self.run(f"delete_{endpoint}", self.dummy_pks)
+        [call] = mock_nexus_api.calls
+        assert call.request.method == "DELETE"
+        assert call.request.url == f"http://nexus/api/{endpoint}"
+        assert json.loads(call.request.content.decode()) == self.dummy_pks_payload
+
+    def test_dropdown_status(self, mock_nexus_api):
+        mock_nexus_api.post(nexus_url("dropdown-status")).respond(200, json={"mon-recap": True})
+        assert self.run("dropdown_status", "email@mailinator.com") == {"mon-recap": True}
+        [call] = mock_nexus_api.calls
+        assert json.loads(call.request.content.decode()) == {"email": "email@mailinator.com"}
+
+    def test_503(self, mock_nexus_api, caplog):
+        mock_nexus_api.post(nexus_url("sync-completed")).respond(503)
+        with pytest.raises(NexusAPIException):
+            self.run("complete_full_sync", "bad start_at")
+        assert caplog.messages[-1].startswith("nexus POST:sync-completed error=Server error '503 Service Unavailable'")
+
+    def test_send_many(self, mock_nexus_api):
+        in_flight = 0
+        max_in_flight = 0
+
+        async def side_effect(request):
+            nonlocal in_flight, max_in_flight
+            in_flight += 1
+            max_in_flight = max(in_flight, max_in_flight)
+            await asyncio.sleep(0.01)
+            in_flight -= 1
+            return httpx.Response(200, json={})
+
+        mock_nexus_api.post(nexus_url("users")).mock(side_effect=side_effect)
+        batches = ([{"id": str(i)}] for i in range(10))
+
+        async def _run():
+            async with AsyncNexusAPIClient() as client:
+                await client.send_many(client.send_users, batches, max_in_flight=3)
+
+        asyncio.run(_run())
+        assert max_in_flight == 3
+        assert sorted(json.loads(call.request.content)[0]["id"] for call in mock_nexus_api.calls) == sorted(
+            str(i) for i in range(10)
+        )
+
+    def test_send_many_error(self, mock_nexus_api):
+        mock_nexus_api.post(nexus_url("users")).respond(503)
+
+        async def _run():
+            async with AsyncNexusAPIClient() as client:
+                await client.send_many(client.send_users, [[{"id": "1"}], [{"id": "2"}]])
+
+        with pytest.raises(NexusAPIException):
+            asyncio.run(_run())
+
+
+class TestRetryPolicy:
+    @pytest.fixture(autouse=True)
+    def setup_method(self, mock_nexus_api, mocker):
+        self.client = NexusAPIClient(retry_policy=RetryPolicy(max_attempts=3))
+        self.mocked_sleep = mocker.patch("itoutils.django.nexus.api.time.sleep")
+
+    def test_retry_then_success(self, mock_nexus_api, caplog):
+        mock_nexus_api.post(nexus_url("users")).mock(
+            side_effect=[httpx.Response(502), httpx.ConnectError("Connection refused"), httpx.Response(200, json={})]
+        )
+        self.client.send_users([{"id": "1"}])
+        assert len(mock_nexus_api.calls) == 3
+        assert self.mocked_sleep.call_count == 2
+        [first_delay], [second_delay] = [call.args for call in self.mocked_sleep.call_args_list]
+        assert 0 <= first_delay <= 0.5
+        assert 0 <= second_delay <= 1
+        nexus_records = [r for r in caplog.records if r.name == "itoutils.django.nexus.api"]
+        nexus_messages = [r.getMessage() for r in nexus_records]
+        assert len(nexus_messages) == 4
+        assert nexus_messages[0].startswith("nexus POST:users attempt 1/3 failed, retrying in")
+        assert nexus_messages[1].startswith("nexus POST:users attempt 2/3 failed, retrying in")
+        assert nexus_messages[2].startswith("nexus POST:users succeeded after 3 attempts in")
+        assert nexus_records[2].__dict__["nexus.retries"] == 2
+        assert nexus_messages[3] == "nexus POST:users status=200"
+        assert nexus_records[3].__dict__["nexus.attempts"] == 3
+
+    def test_give_up_after_max_attempts(self, mock_nexus_api, caplog):
+        mock_nexus_api.post(nexus_url("users")).respond(503)
+        with pytest.raises(NexusAPIException):
+            self.client.send_users([{"id": "1"}])
+        assert len(mock_nexus_api.calls) == 3
+        assert self.mocked_sleep.call_count == 2
+        nexus_messages = [r.getMessage() for r in caplog.records if r.name == "itoutils.django.nexus.api"]
+        assert nexus_messages[2].startswith("nexus POST:users failed after 3 attempts in")
+        assert nexus_messages[3] == "nexus POST:users status=503"
+        assert nexus_messages[4].startswith("nexus POST:users error=Server error '503 Service Unavailable'")
+
+    def test_no_retry_on_client_error(self, mock_nexus_api):
+        mock_nexus_api.post(nexus_url("users")).respond(400, json={})
+        with pytest.raises(NexusAPIException):
+            self.client.send_users([{"id": "1"}])
+        assert len(mock_nexus_api.calls) == 1
+        assert self.mocked_sleep.call_count == 0
+
+    def test_retry_after_seconds(self, mock_nexus_api):
+        mock_nexus_api.post(nexus_url("users")).mock(
+            side_effect=[httpx.Response(429, headers={"Retry-After": "7"}), httpx.Response(200, json={})]
+        )
+        self.client.send_users([{"id": "1"}])
+        self.mocked_sleep.assert_called_once_with(7.0)
+
+    @time_machine.travel("2026-01-01 12:00:00+00:00", tick=False)
+    def test_retry_after_date(self, mock_nexus_api):
+        mock_nexus_api.post(nexus_url("users")).mock(
+            side_effect=[
+                httpx.Response(503, headers={"Retry-After": "Thu, 01 Jan 2026 12:00:10 GMT"}),
+                httpx.Response(200, json={}),
+            ]
+        )
+        self.client.send_users([{"id": "1"}])
+        self.mocked_sleep.assert_called_once_with(10.0)
+
+    def test_retry_after_too_long(self, mock_nexus_api):
+        mock_nexus_api.post(nexus_url("users")).respond(503, headers={"Retry-After": "3600"})
+        with pytest.raises(NexusAPIException):
+            self.client.send_users([{"id": "1"}])
+        assert len(mock_nexus_api.calls) == 1
+
+    def test_custom_retryable_exceptions(self, mock_nexus_api):
+        self.client.retry_policy = RetryPolicy(max_attempts=3, retry_on_exceptions=[httpx.ConnectError])
+        mock_nexus_api.post(nexus_url("users")).mock(side_effect=httpx.ReadTimeout("The read operation timed out"))
+        with pytest.raises(NexusAPIException):
+            self.client.send_users([{"id": "1"}])
+        assert len(mock_nexus_api.calls) == 1
+
+    def test_async_client(self, mock_nexus_api, mocker):
+        mocked_sleep = mocker.patch("itoutils.django.nexus.api.asyncio.sleep")
+        mock_nexus_api.post(nexus_url("users")).mock(side_effect=[httpx.Response(502), httpx.Response(200, json={})])
+
+        async def _run():
+            async with AsyncNexusAPIClient(retry_policy=RetryPolicy()) as client:
+                await client.send_users([{"id": "1"}])
+
+        asyncio.run(_run())
+        assert len(mock_nexus_api.calls) == 2
+        assert mocked_sleep.call_count == 1
+
+
+class TestCompression:
+    def test_gzip_above_threshold(self, mock_nexus_api):
+        measurements = []
+        client = NexusAPIClient(
+            compression="gzip",
+            compression_threshold=100,
+            on_compress=lambda *args: measurements.append(args),
+        )
+        payload = [{"id": str(i), "category": "user"} for i in range(100)]
+        client.send_users(payload)
+        [call] = mock_nexus_api.calls
+        assert call.request.headers["Content-Encoding"] == "gzip"
+        assert call.request.headers["Content-Type"] == "application/json"
+        assert json.loads(gzip.decompress(call.request.content)) == payload
+        [(method, url, raw_size, compressed_size)] = measurements
+        assert (method, url) == ("POST", "users")
+        assert raw_size == len(json.dumps(payload, separators=(",", ":")))
+        assert compressed_size == len(call.request.content) < raw_size
+
+    def test_below_threshold(self, mock_nexus_api):
+        on_compress = mock.Mock()
+        client = NexusAPIClient(compression="gzip", on_compress=on_compress)
+        client.send_users([{"id": "1"}])
+        [call] = mock_nexus_api.calls
+        assert "Content-Encoding" not in call.request.headers
+        assert json.loads(call.request.content) == [{"id": "1"}]
+        on_compress.assert_not_called()
+
+    def test_compression_preserves_retries(self, mock_nexus_api, mocker):
+        mocker.patch("itoutils.django.nexus.api.time.sleep")
+        mock_nexus_api.post(nexus_url("users")).mock(side_effect=[httpx.Response(502), httpx.Response(200, json={})])
+        client = NexusAPIClient(retry_policy=RetryPolicy(), compression="gzip", compression_threshold=0)
+        client.send_users([{"id": "1"}])
+        first_call, second_call = mock_nexus_api.calls
+        assert first_call.request.content == second_call.request.content
+        assert json.loads(gzip.decompress(second_call.request.content)) == [{"id": "1"}]
+
+    @pytest.mark.skipif("zstd" not in COMPRESSORS, reason="zstd is not available")
+    def test_zstd(self, mock_nexus_api):
+        client = NexusAPIClient(compression="zstd", compression_threshold=0)
+        client.send_users([{"id": "1"}])
+        [call] = mock_nexus_api.calls
+        assert call.request.headers["Content-Encoding"] == "zstd"
+
+    def test_unavailable_compression(self, mock_nexus_api, mocker):
+        mocker.patch.dict("itoutils.django.nexus.api.COMPRESSORS", clear=True)
+        with pytest.raises(ImproperlyConfigured):
+            NexusAPIClient(compression="zstd")
+
+    def test_async_client(self, mock_nexus_api):
+        async def _run():
+            async with AsyncNexusAPIClient(compression="gzip", compression_threshold=0) as client:
+                await client.send_users([{"id": "1"}])
+
+        asyncio.run(_run())
+        [call] = mock_nexus_api.calls
+        assert json.loads(gzip.decompress(call.request.content)) == [{"id": "1"}]
+
+
+class TestStreaming:
+    @pytest.fixture(autouse=True)
+    def setup_method(self, mock_nexus_api):
+        self.client = NexusAPIClient()
+
+    def test_stream_generator(self, mock_nexus_api):
+        records = ({"id": str(i)} for i in range(3))
+        self.client.call("POST", "users", json=records)
+        [call] = mock_nexus_api.calls
+        assert call.request.headers["Transfer-Encoding"] == "chunked"
+        assert call.request.headers["Content-Type"] == "application/json"
+        assert json.loads(call.request.content) == [{"id": "0"}, {"id": "1"}, {"id": "2"}]
+
+    def test_stream_empty(self, mock_nexus_api):
+        self.client.call("POST", "users", json=iter([]))
+        [call] = mock_nexus_api.calls
+        assert json.loads(call.request.content) == []
+
+    def test_stream_is_chunked(self, mocker):
+        mocker.patch.object(JSONArrayStream, "CHUNK_SIZE", 20)
+        stream = JSONArrayStream({"id": str(i)} for i in range(5))
+        chunks = list(stream)
+        assert len(chunks) == 3
+        assert json.loads(b"".join(chunks)) == [{"id": str(i)} for i in range(5)]
+        assert stream.raw_size == len(b"".join(chunks))
+
+    def test_stream_with_compression(self, mock_nexus_api):
+        on_compress = mock.Mock()
+        client = NexusAPIClient(compression="gzip", on_compress=on_compress)
+        client.call("POST", "users", json=({"id": str(i)} for i in range(3)))
+        [call] = mock_nexus_api.calls
+        assert call.request.headers["Content-Encoding"] == "gzip"
+        assert json.loads(gzip.decompress(call.request.content)) == [{"id": "0"}, {"id": "1"}, {"id": "2"}]
+        raw_size = len(b'[{"id":"0"},{"id":"1"},{"id":"2"}]')
+        on_compress.assert_called_once_with("POST", "users", raw_size, len(call.request.content))
+
+    def test_replayable_stream_is_retried(self, mock_nexus_api, mocker):
+        mocker.patch("itoutils.django.nexus.api.time.sleep")
+        mock_nexus_api.post(nexus_url("users")).mock(side_effect=[httpx.Response(502), httpx.Response(200, json={})])
+        client = NexusAPIClient(retry_policy=RetryPolicy())
+        client.call("POST", "users", json=LazySerialization(dict, [{"id": "1"}]))
+        assert [json.loads(call.request.content) for call in mock_nexus_api.calls] == [[{"id": "1"}]] * 2
+
+    def test_iterator_stream_is_not_retried(self, mock_nexus_api, mocker, caplog):
+        mocker.patch("itoutils.django.nexus.api.time.sleep")
+        mock_nexus_api.post(nexus_url("users")).respond(502)
+        client = NexusAPIClient(retry_policy=RetryPolicy())
+        with pytest.raises(NexusAPIException):
+            client.call("POST", "users", json=iter([{"id": "1"}]))
+        assert len(mock_nexus_api.calls) == 1
+        assert "nexus POST:users cannot be retried: the request body was streamed from an iterator" in caplog.messages
+
+    def test_async_client(self, mock_nexus_api):
+        async def _run():
+            async with AsyncNexusAPIClient() as client:
+                await client.call("POST", "users", json=({"id": str(i)} for i in range(3)))
+
+        asyncio.run(_run())
+        [call] = mock_nexus_api.calls
+        assert call.request.headers["Transfer-Encoding"] == "chunked"
+        assert json.loads(call.request.content) == [{"id": "0"}, {"id": "1"}, {"id": "2"}]
+
+
+class TestSharedTransport:
+    @pytest.fixture(autouse=True)
+    def reset_shared_transport(self):
+        close_shared_transport()
+        yield
+        close_shared_transport()
+
+    def test_transport_is_shared(self, mock_nexus_api):
+        first_client, second_client = NexusAPIClient(), NexusAPIClient()
+        assert first_client.client._transport is second_client.client._transport is get_shared_transport()
+        first_client.send_users([{"id": "1"}])
+        second_client.send_users([{"id": "1"}])
+        assert len(mock_nexus_api.calls) == 2
+
+    def test_settings(self, mock_nexus_api, settings):
+        settings.NEXUS_API_MAX_CONNECTIONS = 3
+        settings.NEXUS_API_MAX_KEEPALIVE_CONNECTIONS = 2
+        transport = NexusAPIClient().client._transport
+        assert transport._pool._max_connections == 3
+        assert transport._pool._max_keepalive_connections == 2
+
+    def test_env_proxy(self, mock_nexus_api, monkeypatch):
+        monkeypatch.setenv("HTTP_PROXY", "http://proxy:3128")
+        transport = get_shared_transport()
+        assert transport._pool._proxy_url.host == b"proxy"
+
+    def test_env_no_proxy(self, mock_nexus_api, monkeypatch):
+        monkeypatch.setenv("HTTP_PROXY", "http://proxy:3128")
+        monkeypatch.setenv("NO_PROXY", "nexus")
+        transport = get_shared_transport()
+        assert not hasattr(transport._pool, "_proxy_url")
+
+    def test_close(self, mock_nexus_api, mocker):
+        transport = get_shared_transport()
+        close = mocker.spy(transport, "close")
+        close_shared_transport()
+        close.assert_called_once_with()
+        assert get_shared_transport() is not transport
+        client = NexusAPIClient()
+        client.send_users([{"id": "1"}])
+        assert len(mock_nexus_api.calls) == 1
+
+    def test_reset_after_fork(self):
+        transport = get_shared_transport()
+        pid = os.fork()
+        if pid == 0:
+            os._exit(0 if get_shared_transport() is not transport else 1)
+        _, status = os.waitpid(pid, 0)
+        assert os.waitstatus_to_exitcode(status) == 0
+        assert get_shared_transport() is transport
+
+    def test_async_client_has_its_own_pool(self, mock_nexus_api):
+        assert AsyncNexusAPIClient().client._transport is not get_shared_transport()
+
+
+class TestMetrics:
+    @pytest.fixture(autouse=True)
+    def setup_method(self, mock_nexus_api):
+        self.sink = mock.Mock(spec=NexusMetricsSink)
+        self.client = NexusAPIClient(metrics_sink=self.sink)
+
+    def get_metrics_record(self, caplog):
+        [record] = [r for r in caplog.records if r.getMessage().startswith("nexus POST:users status=")]
+        return record
+
+    def test_batch_call(self, mock_nexus_api, caplog):
+        mock_nexus_api.post(nexus_url("users")).respond(200, json={"ok": True})
+        self.client.send_users([{"id": "1"}, {"id": "2"}])
+        record = self.get_metrics_record(caplog)
+        assert record.__dict__["nexus.method"] == "POST"
+        assert record.__dict__["nexus.endpoint"] == "users"
+        assert record.__dict__["nexus.status_code"] == 200
+        assert record.__dict__["nexus.request_bytes"] == len(b'[{"id":"1"},{"id":"2"}]')
+        assert record.__dict__["nexus.response_bytes"] == len(b'{"ok":true}')
+        assert record.__dict__["nexus.item_count"] == 2
+        assert record.__dict__["nexus.attempts"] == 1
+        assert record.duration > 0
+
+        tags = {"method": "POST", "endpoint": "users", "status": "200"}
+        self.sink.increment.assert_called_once_with("nexus.requests", tags)
+        assert self.sink.histogram.call_args_list == [
+            mock.call("nexus.request.duration", record.duration / 1_000_000_000, tags),
+            mock.call("nexus.request.bytes", len(b'[{"id":"1"},{"id":"2"}]'), tags),
+            mock.call("nexus.response.bytes", len(b'{"ok":true}'), tags),
+            mock.call("nexus.request.items", 2, tags),
+        ]
+
+    def test_streamed_and_compressed_call(self, mock_nexus_api, caplog):
+        self.client.compression = "gzip"
+        self.client.send_users({"id": str(i)} for i in range(3))
+        record = self.get_metrics_record(caplog)
+        [call] = mock_nexus_api.calls
+        assert call.request.headers["Transfer-Encoding"] == "chunked"
+        assert record.__dict__["nexus.request_bytes"] == len(call.request.content)
+        assert record.__dict__["nexus.item_count"] == 3
+
+    def test_non_batch_call(self, mock_nexus_api, caplog):
+        self.client.dropdown_status("email@mailinator.com")
+        [record] = [r for r in caplog.records if r.getMessage() == "nexus POST:dropdown-status status=200"]
+        assert record.__dict__["nexus.item_count"] is None
+        assert [call.args[0] for call in self.sink.histogram.call_args_list] == [
+            "nexus.request.duration",
+            "nexus.request.bytes",
+            "nexus.response.bytes",
+        ]
+
+    def test_transport_error(self, mock_nexus_api, caplog):
+        mock_nexus_api.post(nexus_url("users")).mock(side_effect=httpx.ConnectError("Connection refused"))
+        with pytest.raises(NexusAPIException):
+            self.client.send_users([{"id": "1"}])
+        record = self.get_metrics_record(caplog)
+        assert record.getMessage() == "nexus POST:users status=ConnectError"
+        assert record.__dict__["nexus.status_code"] is None
+        assert record.__dict__["nexus.response_bytes"] == 0
+        self.sink.increment.assert_called_once_with(
+            "nexus.requests", {"method": "POST", "endpoint": "users", "status": "ConnectError"}
+        )
+
+    def test_sink_from_settings(self, settings):
+        settings.NEXUS_API_METRICS_SINK = "itoutils.django.nexus.metrics.NexusMetricsSink"
+        assert isinstance(NexusAPIClient().metrics_sink, NexusMetricsSink)
+
+    def test_fields_are_in_json_logs(self, mock_nexus_api, capture_stream_handler_log):
+        with capture_stream_handler_log(logging.getLogger()) as captured:
+            self.client.send_users([{"id": "1"}])
+        [log] = [
+            json.loads(line)
+            for line in captured.getvalue().splitlines()
+            if line.startswith("{") and "status=200" in line
+        ]
+        assert log["nexus.endpoint"] == "users"
+        assert log["nexus.item_count"] == 1
+        assert log["nexus.status_code"] == 200
+        assert log["duration"] > 0
+
+
+class TestBatching:
+    def get_payloads(self, mock_nexus_api):
+        return [json.loads(call.request.content) for call in mock_nexus_api.calls]
+
+    def test_split_by_item_count(self, mock_nexus_api):
+        client = NexusAPIClient(max_batch_items=2)
+        client.send_users({"id": str(i)} for i in range(5))
+        assert self.get_payloads(mock_nexus_api) == [
+            [{"id": "0"}, {"id": "1"}],
+            [{"id": "2"}, {"id": "3"}],
+            [{"id": "4"}],
+        ]
+
+    def test_split_by_size(self, mock_nexus_api):
+        # Each item is 10 bytes long: [{"id":"0"}] is 12 bytes, [{"id":"0"},{"id":"1"}] 23 bytes
+        client = NexusAPIClient(max_batch_bytes=23)
+        client.send_structures([{"id": str(i)} for i in range(5)])
+        assert self.get_payloads(mock_nexus_api) == [
+            [{"id": "0"}, {"id": "1"}],
+            [{"id": "2"}, {"id": "3"}],
+            [{"id": "4"}],
+        ]
+        assert all(len(call.request.content) <= 23 for call in mock_nexus_api.calls)
+
+    def test_oversized_item_is_sent_alone(self, mock_nexus_api):
+        client = NexusAPIClient(max_batch_bytes=20)
+        client.send_memberships([{"id": "0"}, {"id": "1", "name": "long enough"}, {"id": "2"}])
+        assert self.get_payloads(mock_nexus_api) == [
+            [{"id": "0"}],
+            [{"id": "1", "name": "long enough"}],
+            [{"id": "2"}],
+        ]
+
+    def test_delete(self, mock_nexus_api):
+        client = NexusAPIClient(max_batch_items=2)
+        client.delete_users(range(3))
+        assert [call.request.method for call in mock_nexus_api.calls] == ["DELETE", "DELETE"]
+        assert self.get_payloads(mock_nexus_api) == [[{"id": "0"}, {"id": "1"}], [{"id": "2"}]]
+
+    def test_nothing_to_send(self, mock_nexus_api):
+        client = NexusAPIClient()
+        client.send_users([])
+        client.delete_users([])
+        assert mock_nexus_api.calls.call_count == 0
+
+    def test_batches_are_retried(self, mock_nexus_api, mocker):
+        mocker.patch("itoutils.django.nexus.api.time.sleep")
+        mock_nexus_api.post(nexus_url("users")).mock(
+            side_effect=[httpx.Response(200, json={}), httpx.Response(502), httpx.Response(200, json={})]
+        )
+        client = NexusAPIClient(max_batch_items=1, retry_policy=RetryPolicy())
+        client.send_users(iter([{"id": "0"}, {"id": "1"}]))
+        assert self.get_payloads(mock_nexus_api) == [[{"id": "0"}], [{"id": "1"}], [{"id": "1"}]]
+        assert all(call.request.headers["Transfer-Encoding"] == "chunked" for call in mock_nexus_api.calls)
+
+    def test_batches_of_generators_are_streamed(self, mock_nexus_api, mocker):
+        mocker.patch.object(JSONArrayStream, "CHUNK_SIZE", 20)
+        client = NexusAPIClient(max_batch_items=3, compression="gzip")
+        client.send_users({"id": str(i)} for i in range(5))
+        assert [json.loads(gzip.decompress(call.request.content)) for call in mock_nexus_api.calls] == [
+            [{"id": "0"}, {"id": "1"}, {"id": "2"}],
+            [{"id": "3"}, {"id": "4"}],
+        ]
+        assert all(call.request.headers["Transfer-Encoding"] == "chunked" for call in mock_nexus_api.calls)
+
+    def test_batches_of_lists_are_not_streamed(self, mock_nexus_api):
+        client = NexusAPIClient(max_batch_items=3)
+        client.send_users([{"id": str(i)} for i in range(5)])
+        assert [call.request.headers["Content-Length"] for call in mock_nexus_api.calls] == ["34", "23"]
+
+    def test_deleted_pks_are_not_streamed(self, mock_nexus_api):
+        client = NexusAPIClient(compression="gzip")
+        client.delete_users([1, 2])
+        [call] = mock_nexus_api.calls
+        assert "Transfer-Encoding" not in call.request.headers
+        assert "Content-Encoding" not in call.request.headers
+        assert call.request.headers["Content-Length"] == str(len(call.request.content))
+        assert json.loads(call.request.content) == [{"id": "1"}, {"id": "2"}]
+
+    def test_deleted_pks_generator_is_streamed(self, mock_nexus_api):
+        client = NexusAPIClient()
+        client.delete_users(pk for pk in [1, 2])
+        [call] = mock_nexus_api.calls
+        assert call.request.headers["Transfer-Encoding"] == "chunked"
+
+    def test_adapt_batch_size(self, mock_nexus_api):
+        client = NexusAPIClient(max_batch_items=1_000, target_batch_latency=2)
+        client.adapt_batch_size(3)
+        assert client.batch_size == 500
+        for _ in range(5):
+            client.adapt_batch_size(3)
+        assert client.batch_size == client.MIN_BATCH_ITEMS
+        client.adapt_batch_size(1)
+        assert client.batch_size == 110
+        for _ in range(100):
+            client.adapt_batch_size(1)
+        assert client.batch_size == 1_000
+
+    def test_adapt_batch_size_disabled(self, mock_nexus_api):
+        client = NexusAPIClient(max_batch_items=1_000)
+        client.adapt_batch_size(3600)
+        assert client.batch_size == 1_000
+
+    def test_batch_size_adapts_to_latency(self, mock_nexus_api, mocker):
+        # First batch takes 10 seconds, the others are instantaneous
+        mocker.patch("itoutils.django.nexus.api.time.monotonic", side_effect=[0, 10] + [10] * 10)
+        client = NexusAPIClient(max_batch_items=4, target_batch_latency=5)
+        client.MIN_BATCH_ITEMS = 1
+        client.send_users({"id": str(i)} for i in range(8))
+        assert [len(payload) for payload in self.get_payloads(mock_nexus_api)] == [4, 2, 2]
+
+    def test_async_client(self, mock_nexus_api):
+        async def _run():
+            async with AsyncNexusAPIClient(max_batch_items=2) as client:
+                await client.delete_structures(["a", "b", "c"])
+
+        asyncio.run(_run())
+        assert self.get_payloads(mock_nexus_api) == [[{"id": "a"}, {"id": "b"}], [{"id": "c"}]]
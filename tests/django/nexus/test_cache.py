@@ -0,0 +1,124 @@
+import threading
+
+import pytest
+from django.core.cache import cache
+
+from itoutils.django.nexus.cache import DropdownStatusCache, cached_dropdown_status, invalidate_dropdown_status
+from itoutils.pytest import nexus_url
+
+EMAIL = "email@mailinator.com"
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    cache.clear()
+    yield
+    cache.clear()
+
+
+@pytest.fixture(name="dropdown_status")
+def dropdown_status_fixture(mock_nexus_api):
+    return mock_nexus_api.post(nexus_url("dropdown-status"))
+
+
+class TestDropdownStatusCache:
+    @pytest.fixture(name="status_cache")
+    def status_cache_fixture(self, mocker):
+        status_cache = DropdownStatusCache(ttl=60, stale_ttl=600, error_ttl=30)
+        # Run the background refresh synchronously
+        mocker.patch.object(status_cache, "run_in_background", side_effect=lambda target: target())
+        return status_cache
+
+    def test_fresh_value_is_cached(self, status_cache, dropdown_status):
+        dropdown_status.respond(200, json={"mon-recap": True})
+        assert status_cache.get(EMAIL) == {"mon-recap": True}
+        assert status_cache.get(EMAIL.upper()) == {"mon-recap": True}
+        assert dropdown_status.call_count == 1
+
+    def test_stale_while_revalidate(self, status_cache, dropdown_status, time_machine):
+        time_machine.move_to("2025-01-01 12:00:00Z", tick=False)
+        dropdown_status.respond(200, json={"mon-recap": True})
+        status_cache.get(EMAIL)
+
+        dropdown_status.respond(200, json={"mon-recap": False})
+        time_machine.shift(59)
+        assert status_cache.get(EMAIL) == {"mon-recap": True}
+        assert dropdown_status.call_count == 1
+
+        # The stale value is returned while it is refreshed
+        time_machine.shift(1)
+        assert status_cache.get(EMAIL) == {"mon-recap": True}
+        assert dropdown_status.call_count == 2
+        assert status_cache.get(EMAIL) == {"mon-recap": False}
+        assert dropdown_status.call_count == 2
+
+    def test_expired_value_is_fetched(self, status_cache, dropdown_status, time_machine):
+        time_machine.move_to("2025-01-01 12:00:00Z", tick=False)
+        dropdown_status.respond(200, json={"mon-recap": True})
+        status_cache.get(EMAIL)
+
+        dropdown_status.respond(200, json={"mon-recap": False})
+        time_machine.shift(660)
+        assert status_cache.get(EMAIL) == {"mon-recap": False}
+
+    def test_errors_are_cached(self, status_cache, dropdown_status, time_machine):
+        time_machine.move_to("2025-01-01 12:00:00Z", tick=False)
+        dropdown_status.respond(500)
+        assert status_cache.get(EMAIL) is None
+        assert status_cache.get(EMAIL) is None
+        assert dropdown_status.call_count == 1
+
+        dropdown_status.respond(200, json={"mon-recap": True})
+        time_machine.shift(30)
+        assert status_cache.get(EMAIL) == {"mon-recap": True}
+
+    def test_refresh_error_keeps_stale_value(self, status_cache, dropdown_status, time_machine):
+        time_machine.move_to("2025-01-01 12:00:00Z", tick=False)
+        dropdown_status.respond(200, json={"mon-recap": True})
+        status_cache.get(EMAIL)
+
+        dropdown_status.respond(500)
+        time_machine.shift(60)
+        assert status_cache.get(EMAIL) == {"mon-recap": True}
+        assert dropdown_status.call_count == 2
+        # Don't retry before error_ttl
+        time_machine.shift(29)
+        assert status_cache.get(EMAIL) == {"mon-recap": True}
+        assert dropdown_status.call_count == 2
+
+    def test_single_background_refresh(self, dropdown_status, time_machine, mocker):
+        time_machine.move_to("2025-01-01 12:00:00Z", tick=False)
+        status_cache = DropdownStatusCache()
+        run_in_background = mocker.patch.object(status_cache, "run_in_background")
+        dropdown_status.respond(200, json={"mon-recap": True})
+        status_cache.get(EMAIL)
+
+        time_machine.shift(status_cache.ttl)
+        for _ in range(3):
+            assert status_cache.get(EMAIL) == {"mon-recap": True}
+        assert run_in_background.call_count == 1
+
+    def test_background_thread(self, dropdown_status, time_machine):
+        time_machine.move_to("2025-01-01 12:00:00Z", tick=False)
+        status_cache = DropdownStatusCache()
+        dropdown_status.respond(200, json={"mon-recap": True})
+        status_cache.get(EMAIL)
+
+        dropdown_status.respond(200, json={"mon-recap": False})
+        time_machine.shift(status_cache.ttl)
+        assert status_cache.get(EMAIL) == {"mon-recap": True}
+        for thread in threading.enumerate():
+            if thread.name == "nexus-dropdown-status-refresh":
+                thread.join()
+        assert status_cache.get(EMAIL) == {"mon-recap": False}
+        assert dropdown_status.call_count == 2
+
+
+def test_invalidate(dropdown_status):
+    dropdown_status.respond(200, json={"mon-recap": True})
+    assert cached_dropdown_status(EMAIL) == {"mon-recap": True}
+    dropdown_status.respond(200, json={"mon-recap": False})
+    assert cached_dropdown_status(EMAIL) == {"mon-recap": True}
+    invalidate_dropdown_status(EMAIL)
+    assert cached_dropdown_status(EMAIL) == {"mon-recap": False}
+    assert dropdown_status.call_count == 2
@@ -0,0 +1,199 @@
+import asyncio
+
+import httpx
+import pytest
+
+from itoutils.django.nexus.api import (
+    AsyncNexusAPIClient,
+    NexusAPIClient,
+    NexusAPIException,
+    NexusCircuitOpenException,
+    RetryPolicy,
+)
+from itoutils.django.nexus.circuit_breaker import (
+    CircuitBreaker,
+    CircuitState,
+    get_circuit_breaker,
+    reset_circuit_breaker,
+)
+from itoutils.pytest import nexus_url
+
+
+class TestCircuitBreaker:
+    def test_opens_after_consecutive_failures(self):
+        breaker = CircuitBreaker(failure_threshold=3)
+        for _ in range(2):
+            breaker.record_failure()
+        breaker.record_success()
+        for _ in range(2):
+            breaker.record_failure()
+        assert breaker.state == CircuitState.CLOSED
+        assert breaker.allow_request() is True
+        breaker.record_failure()
+        assert breaker.state == CircuitState.OPEN
+        assert breaker.allow_request() is False
+
+    @pytest.fixture(name="monotonic")
+    def monotonic_fixture(self, mocker):
+        return mocker.patch("itoutils.django.nexus.circuit_breaker.time.monotonic", return_value=1_000)
+
+    def test_half_open_then_closed(self, caplog, monotonic):
+        breaker = CircuitBreaker(failure_threshold=1, recovery_timeout=30, half_open_max_calls=1)
+        breaker.record_failure()
+        monotonic.return_value += 29
+        assert breaker.allow_request() is False
+        monotonic.return_value += 1
+        assert breaker.allow_request() is True
+        assert breaker.state == CircuitState.HALF_OPEN
+        # Only one trial call at a time
+        assert breaker.allow_request() is False
+        breaker.record_success()
+        assert breaker.state == CircuitState.CLOSED
+        assert breaker.allow_request() is True
+        assert caplog.messages == [
+            "nexus circuit breaker closed -> open",
+            "nexus circuit breaker open -> half-open",
+            "nexus circuit breaker half-open -> closed",
+        ]
+
+    def test_half_open_then_open(self, monotonic):
+        breaker = CircuitBreaker(failure_threshold=3, recovery_timeout=30)
+        for _ in range(3):
+            breaker.record_failure()
+        monotonic.return_value += 30
+        assert breaker.allow_request() is True
+        # A single failure is enough to open the circuit again
+        breaker.record_failure()
+        assert breaker.state == CircuitState.OPEN
+        monotonic.return_value += 29
+        assert breaker.allow_request() is False
+
+    def test_release_half_open_trial(self, monotonic):
+        breaker = CircuitBreaker(failure_threshold=1, recovery_timeout=30)
+        breaker.record_failure()
+        monotonic.return_value += 30
+        assert breaker.allow_request() is True
+        assert breaker.allow_request() is False
+        breaker.release()
+        assert breaker.state == CircuitState.HALF_OPEN
+        assert breaker.allow_request() is True
+
+    def test_lost_half_open_trial_expires(self, monotonic):
+        breaker = CircuitBreaker(failure_threshold=1, recovery_timeout=30)
+        breaker.record_failure()
+        monotonic.return_value += 30
+        assert breaker.allow_request() is True
+        monotonic.return_value += 29
+        assert breaker.allow_request() is False
+        monotonic.return_value += 1
+        assert breaker.allow_request() is True
+        assert breaker.allow_request() is False
+
+    @pytest.mark.parametrize(
+        "exc,is_failure",
+        [
+            (httpx.ConnectError("Connection refused"), True),
+            (httpx.ReadTimeout("The read operation timed out"), True),
+            (httpx.HTTPStatusError("", request=None, response=httpx.Response(502)), True),
+            (httpx.HTTPStatusError("", request=None, response=httpx.Response(400)), False),
+        ],
+    )
+    def test_is_failure(self, exc, is_failure):
+        assert CircuitBreaker().is_failure(exc) is is_failure
+
+
+class TestClientWithCircuitBreaker:
+    def test_short_circuit(self, mock_nexus_api, caplog):
+        breaker = CircuitBreaker(failure_threshold=2)
+        client = NexusAPIClient(circuit_breaker=breaker)
+        mock_nexus_api.post(nexus_url("users")).mock(side_effect=httpx.ConnectError("Connection refused"))
+        for _ in range(2):
+            with pytest.raises(NexusAPIException):
+                client.send_users([{"id": "1"}])
+        assert len(mock_nexus_api.calls) == 2
+
+        # Another client sharing the same breaker doesn't even try to call Nexus
+        other_client = NexusAPIClient(circuit_breaker=breaker)
+        with pytest.raises(NexusCircuitOpenException):
+            other_client.send_structures([{"id": "1"}])
+        assert len(mock_nexus_api.calls) == 2
+        assert caplog.messages[-1] == "nexus POST:structures skipped: circuit breaker is open"
+
+    def test_client_errors_dont_open_the_circuit(self, mock_nexus_api):
+        breaker = CircuitBreaker(failure_threshold=1)
+        client = NexusAPIClient(circuit_breaker=breaker)
+        mock_nexus_api.post(nexus_url("users")).respond(400, json={})
+        with pytest.raises(NexusAPIException):
+            client.send_users([{"id": "1"}])
+        assert breaker.state == CircuitState.CLOSED
+
+    def test_open_circuit_stops_retries(self, mock_nexus_api, mocker):
+        mocker.patch("itoutils.django.nexus.api.time.sleep")
+        client = NexusAPIClient(retry_policy=RetryPolicy(), circuit_breaker=CircuitBreaker(failure_threshold=2))
+        mock_nexus_api.post(nexus_url("users")).respond(503)
+        with pytest.raises(NexusCircuitOpenException):
+            client.send_users([{"id": "1"}])
+        assert len(mock_nexus_api.calls) == 2
+
+    def test_async_client(self, mock_nexus_api):
+        breaker = CircuitBreaker(failure_threshold=1)
+        mock_nexus_api.post(nexus_url("users")).respond(503)
+
+        async def _run():
+            async with AsyncNexusAPIClient(circuit_breaker=breaker) as client:
+                with pytest.raises(NexusAPIException):
+                    await client.send_users([{"id": "1"}])
+                with pytest.raises(NexusCircuitOpenException):
+                    await client.send_users([{"id": "1"}])
+
+        asyncio.run(_run())
+        assert len(mock_nexus_api.calls) == 1
+
+    def test_cancelled_trial_releases_its_slot(self, mock_nexus_api, mocker):
+        monotonic = mocker.patch("itoutils.django.nexus.circuit_breaker.time.monotonic", return_value=1_000)
+        breaker = CircuitBreaker(failure_threshold=1, recovery_timeout=30)
+        breaker.record_failure()
+        monotonic.return_value += 30
+        started = asyncio.Event()
+
+        async def side_effect(request):
+            started.set()
+            await asyncio.sleep(10)
+
+        mock_nexus_api.post(nexus_url("users")).mock(side_effect=side_effect)
+
+        async def _run():
+            async with AsyncNexusAPIClient(circuit_breaker=breaker) as client:
+                task = asyncio.create_task(client.send_users([{"id": "1"}]))
+                await started.wait()
+                task.cancel()
+                with pytest.raises(asyncio.CancelledError):
+                    await task
+
+        asyncio.run(_run())
+        assert breaker.state == CircuitState.HALF_OPEN
+        assert breaker.allow_request() is True
+
+
+class TestSharedCircuitBreaker:
+    @pytest.fixture(autouse=True)
+    def reset(self):
+        reset_circuit_breaker()
+        yield
+        reset_circuit_breaker()
+
+    def test_shared_by_default(self, mock_nexus_api, settings):
+        settings.NEXUS_API_CIRCUIT_BREAKER_FAILURE_THRESHOLD = 2
+        mock_nexus_api.post(nexus_url("users")).respond(503)
+        for _ in range(2):
+            with pytest.raises(NexusAPIException):
+                NexusAPIClient().send_users([{"id": "1"}])
+        assert get_circuit_breaker().state == CircuitState.OPEN
+        with pytest.raises(NexusCircuitOpenException):
+            NexusAPIClient().send_users([{"id": "1"}])
+        assert len(mock_nexus_api.calls) == 2
+
+    def test_disabled(self, mock_nexus_api, settings):
+        settings.NEXUS_API_CIRCUIT_BREAKER_FAILURE_THRESHOLD = None
+        assert get_circuit_breaker() is None
+        assert NexusAPIClient().circuit_breaker is None
@@ -0,0 +1,87 @@
+import threading
+
+import pytest
+
+from itoutils.django.nexus.api import NexusAPIException
+from itoutils.django.nexus.dispatcher import NexusDispatcher
+from itoutils.django.nexus.metrics import NexusMetricsSink
+from testproject.testapp.models import SyncedItem
+from tests.django.factories import SyncedItemFactory, UserFactory
+
+
+@pytest.mark.usefixtures("mock_synced_item")
+class TestNexusDispatcher:
+    @pytest.fixture(name="dispatcher")
+    def dispatcher_fixture(self, mocker):
+        dispatcher = NexusDispatcher(batch_window=0.05, metrics_sink=mocker.Mock(spec=NexusMetricsSink))
+        yield dispatcher
+        dispatcher.shutdown()
+
+    def test_batching(self, transactional_db, dispatcher):
+        user = UserFactory()
+        synced_items = [SyncedItemFactory(user=user) for _ in range(3)]
+        self.mocked_sync.reset_mock()
+        for synced_item in synced_items:
+            dispatcher.submit(SyncedItem, [synced_item.pk])
+        dispatcher.submit(SyncedItem, [0])
+        dispatcher.flush()
+        self.mocked_sync.assert_called_once()
+        assert set(self.mocked_sync.call_args.args[0]) == set(synced_items)
+        self.mocked_delete.assert_called_once_with([0])
+        dispatcher.metrics_sink.histogram.assert_any_call("nexus.dispatcher.batch_items", 4, {})
+
+    def test_overflow_is_sent_inline(self, transactional_db, caplog, mocker):
+        synced_item = SyncedItemFactory()
+        self.mocked_sync.reset_mock()
+        sending = threading.Event()
+        release = threading.Event()
+
+        def sync(objs):
+            if threading.current_thread().name.startswith("nexus-dispatcher"):
+                sending.set()
+                release.wait()
+
+        self.mocked_sync.side_effect = sync
+        dispatcher = NexusDispatcher(max_queue_size=1, batch_window=0, metrics_sink=mocker.Mock())
+        try:
+            dispatcher.submit(SyncedItem, [synced_item.pk])
+            sending.wait()
+            dispatcher.submit(SyncedItem, [synced_item.pk, synced_item.pk])
+            # One change is queued, the other one was sent inline
+            assert self.mocked_sync.call_count == 2
+            assert caplog.messages == ["nexus dispatcher queue is full, sending 1 changes inline"]
+            dispatcher.metrics_sink.increment.assert_called_once_with("nexus.dispatcher.overflow", {})
+            release.set()
+            dispatcher.flush()
+            assert self.mocked_sync.call_count == 3
+        finally:
+            release.set()
+            dispatcher.shutdown()
+
+    def test_errors_dont_stop_the_worker(self, transactional_db, dispatcher, caplog):
+        synced_item = SyncedItemFactory()
+        self.mocked_sync.reset_mock()
+        self.mocked_sync.side_effect = [NexusAPIException, None]
+        dispatcher.submit(SyncedItem, [synced_item.pk])
+        dispatcher.flush()
+        assert caplog.messages == ["nexus dispatcher failed to send 1 changes"]
+        dispatcher.submit(SyncedItem, [synced_item.pk])
+        dispatcher.flush()
+        assert self.mocked_sync.call_count == 2
+
+    def test_shutdown_sends_pending_changes(self, transactional_db):
+        synced_item = SyncedItemFactory()
+        self.mocked_sync.reset_mock()
+        dispatcher = NexusDispatcher(batch_window=10)
+        dispatcher.submit(SyncedItem, [synced_item.pk])
+        dispatcher.shutdown()
+        self.mocked_sync.assert_called_once_with([synced_item])
+        assert dispatcher.threads == []
+
+    def test_model_changes_are_dispatched(self, transactional_db, dispatcher, mocker):
+        mocker.patch.object(SyncedItem, "nexus_use_dispatcher", True)
+        mocker.patch("itoutils.django.nexus.dispatcher._dispatcher", dispatcher)
+        synced_item = SyncedItemFactory()
+        dispatcher.flush()
+        self.mocked_sync.assert_called_once_with([synced_item])
+        assert len(dispatcher.threads) == 1
@@ -0,0 +1,86 @@
+import httpx
+import pytest
+from django.core.management import call_command
+
+from itoutils.django.nexus.api import NexusAPIClient, NexusAPIException, RetryPolicy
+from itoutils.django.nexus.payloads import NexusUser
+from testproject.testapp.models import Item
+
+
+class TestFakeNexusServer:
+    def test_sync_and_delete(self, fake_nexus_server):
+        client = NexusAPIClient(compression="gzip", compression_threshold=0)
+        client.send_users([NexusUser(id="1", first_name="Jeanne"), NexusUser(id="2")])
+        client.delete_users([2])
+        assert fake_nexus_server.records["users"] == {"1": NexusUser(id="1", first_name="Jeanne").to_dict()}
+        [request] = fake_nexus_server.requests_to("POST", "users")
+        assert request.headers["Content-Encoding"] == "gzip"
+        assert fake_nexus_server.stats()["calls"] == {"POST:users": 1, "DELETE:users": 1}
+
+    def test_streamed_body(self, fake_nexus_server):
+        NexusAPIClient().call("POST", "structures", json=({"id": str(i)} for i in range(1000)))
+        assert len(fake_nexus_server.records["structures"]) == 1000
+        [request] = fake_nexus_server.requests
+        assert request.headers["Transfer-Encoding"] == "chunked"
+
+    def test_full_sync_command(self, db, fake_nexus_server):
+        Item.objects.create(category="structure")
+        user = Item.objects.create(category="user")
+        call_command("nexus_full_sync")
+        assert fake_nexus_server.records["users"] == {str(user.pk): {"id": str(user.pk), "category": "user"}}
+        assert [full_sync["completed"] for full_sync in fake_nexus_server.full_syncs] == [True]
+
+    @pytest.mark.parametrize(
+        "endpoint,payload",
+        [
+            ("users", {"id": "1"}),
+            ("users", [{"id": 1}]),
+            ("sync-completed", {"started_at": "2025-01-01T00:00:00+00:00"}),
+            ("dropdown-status", {}),
+        ],
+    )
+    def test_invalid_payloads(self, fake_nexus_server, endpoint, payload):
+        with pytest.raises(NexusAPIException):
+            NexusAPIClient().call("POST", endpoint, json=payload)
+        assert fake_nexus_server.records["users"] == {}
+
+    def test_invalid_delete_payload(self, fake_nexus_server):
+        response = httpx.request("DELETE", f"{fake_nexus_server.base_url}users", json=[{"id": "1", "name": "Jeanne"}])
+        assert response.status_code == 401
+        response = httpx.request(
+            "DELETE",
+            f"{fake_nexus_server.base_url}users",
+            json=[{"id": "1", "name": "Jeanne"}],
+            headers={"Authorization": "Token very-secret-token"},
+        )
+        assert response.status_code == 400
+
+    def test_dropdown_status(self, fake_nexus_server):
+        fake_nexus_server.dropdown_statuses["email@mailinator.com"] = {"mon-recap": True}
+        assert NexusAPIClient().dropdown_status("email@mailinator.com") == {"mon-recap": True}
+
+    def test_injected_errors_are_retried(self, fake_nexus_server, mocker):
+        mocked_sleep = mocker.patch("itoutils.django.nexus.api.time.sleep")
+        fake_nexus_server.add_fault(method="POST", endpoint="users", status=429, retry_after="2")
+        fake_nexus_server.add_fault(endpoint="users", status=503)
+        NexusAPIClient(retry_policy=RetryPolicy()).send_users([{"id": "1"}])
+        assert mocked_sleep.call_args_list[0] == mocker.call(2.0)
+        assert mocked_sleep.call_count == 2
+        assert fake_nexus_server.records["users"] == {"1": {"id": "1"}}
+        assert fake_nexus_server.faults == []
+
+    def test_injected_timeout(self, fake_nexus_server):
+        fake_nexus_server.add_fault(endpoint="users", timeout=True)
+        client = NexusAPIClient()
+        client.client.timeout = httpx.Timeout(0.1)
+        with pytest.raises(NexusAPIException) as exc_info:
+            client.send_users([{"id": "1"}])
+        assert isinstance(exc_info.value.__cause__, httpx.ReadTimeout)
+
+    def test_random_errors(self, fake_nexus_server):
+        fake_nexus_server.error_rate = 1
+        fake_nexus_server.error_statuses = (500,)
+        with pytest.raises(NexusAPIException):
+            NexusAPIClient().send_users([{"id": "1"}])
+        fake_nexus_server.error_rate = 0
+        NexusAPIClient().send_users([{"id": "1"}])
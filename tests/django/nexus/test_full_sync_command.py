@@ -1,8 +1,17 @@
 import json
+import threading
+import time
 
+import httpx
+import pytest
 from django.core.management import call_command
+from django.db.models.expressions import RawSQL
 
-from itoutils.django.nexus.api import NexusAPIClient
+from itoutils.django.nexus.api import NexusAPIClient, NexusAPIException, RetryPolicy
+from itoutils.django.nexus.management.base_full_sync import SendPipeline
+from itoutils.django.nexus.payload_hashes.models import PayloadHash
+from itoutils.pytest import nexus_url
+from testproject.testapp.management.commands.nexus_full_sync import Command
 from testproject.testapp.models import Item
 
 
@@ -45,3 +54,228 @@ def test_full_sync_disabled(db, caplog, mocker):
     call_command("nexus_full_sync")
     assert caplog.messages == ["Nexus full sync is disabled"]
     assert mocked.call_count == 0
+
+
+def test_full_sync_retries_transient_errors(db, mock_nexus_api, mocker):
+    mocked_sleep = mocker.patch("itoutils.django.nexus.api.time.sleep")
+    mock_nexus_api.post(nexus_url("users")).mock(side_effect=[httpx.Response(502), httpx.Response(200, json={})])
+    user = Item.objects.create(category="user")
+
+    call_command("nexus_full_sync")
+
+    assert mocked_sleep.call_count == 1
+    user_calls = [call for call in mock_nexus_api.calls if call.request.url == "http://nexus/api/users"]
+    assert [json.loads(call.request.content) for call in user_calls] == [
+        [{"id": str(user.pk), "category": "user"}]
+    ] * 2
+    assert mock_nexus_api.calls.last.request.url == "http://nexus/api/sync-completed"
+
+
+def test_full_sync_pipelined(db, mock_nexus_api, mocker):
+    mocker.patch.object(Command, "IN_FLIGHT_BATCHES", 2)
+    mocker.patch.object(Command, "CHUNK_SIZE", 1)
+    users = [Item.objects.create(category="user") for _ in range(5)]
+    structure = Item.objects.create(category="structure")
+
+    call_command("nexus_full_sync")
+
+    urls = [str(call.request.url) for call in mock_nexus_api.calls]
+    assert urls[0] == "http://nexus/api/sync-start"
+    assert urls[-1] == "http://nexus/api/sync-completed"
+    assert sorted(urls[1:-1]) == ["http://nexus/api/structures"] + ["http://nexus/api/users"] * 5
+    sent = [json.loads(call.request.content) for call in mock_nexus_api.calls[1:-1]]
+    assert sorted(record["id"] for records in sent for record in records) == sorted(
+        str(item.pk) for item in [*users, structure]
+    )
+
+
+def test_full_sync_pipelined_error(db, mock_nexus_api, mocker):
+    mocker.patch.object(Command, "IN_FLIGHT_BATCHES", 2)
+    mocker.patch.object(Command, "retry_policy", RetryPolicy(max_attempts=1))
+    mock_nexus_api.post(nexus_url("users")).respond(400, json={})
+    Item.objects.create(category="user")
+
+    with pytest.raises(NexusAPIException):
+        call_command("nexus_full_sync")
+    assert mock_nexus_api.calls.last.request.url == "http://nexus/api/users"
+
+
+def test_full_sync_parallel_entities(transactional_db, fake_nexus_server, mocker):
+    mocker.patch.object(Command, "IN_FLIGHT_BATCHES", 3)
+    mocker.patch.object(Command, "PARALLEL_ENTITIES", True)
+    mocker.patch.object(Command, "CHUNK_SIZE", 2)
+    items = [Item.objects.create(category=category) for category in ["user", "structure", "membership"] * 3]
+
+    call_command("nexus_full_sync")
+
+    assert fake_nexus_server.full_syncs == [{"started_at": mocker.ANY, "completed": True}]
+    for entity, category in [("users", "user"), ("structures", "structure"), ("memberships", "membership")]:
+        assert fake_nexus_server.records[entity] == {
+            str(item.pk): {"id": str(item.pk), "category": category} for item in items if item.category == category
+        }
+        assert len(fake_nexus_server.requests_to("POST", entity)) == 2
+
+
+class TestSendPipeline:
+    def test_back_pressure(self):
+        lock = threading.Lock()
+        running = []
+        max_running = 0
+
+        def send(i):
+            nonlocal max_running
+            with lock:
+                running.append(i)
+                max_running = max(max_running, len(running))
+            time.sleep(0.01)
+            with lock:
+                running.remove(i)
+
+        with SendPipeline(2) as pipeline:
+            for i in range(6):
+                pipeline.submit(send, i)
+        assert max_running == 2
+
+    def test_error(self):
+        sent = []
+
+        def send(i):
+            if i == 0:
+                raise ValueError
+            sent.append(i)
+
+        with pytest.raises(ValueError):
+            with SendPipeline(1) as pipeline:
+                for i in range(5):
+                    pipeline.submit(send, i)
+        assert sent == []
+
+
+def get_ctids():
+    # The physical location of each row, changed when it is rewritten
+    return dict(PayloadHash.objects.annotate(ctid=RawSQL("ctid::text", ())).values_list("object_id", "ctid"))
+
+
+class TestPayloadHashes:
+    @pytest.fixture(autouse=True)
+    def setup_command(self, mocker):
+        mocker.patch.object(Command, "USE_PAYLOAD_HASHES", True)
+
+    def test_send_changes_only(self, db, fake_nexus_server):
+        users = [Item.objects.create(category="user") for _ in range(3)]
+        structure = Item.objects.create(category="structure")
+
+        # Nothing stored yet: a full sync
+        call_command("nexus_full_sync")
+        assert [full_sync["completed"] for full_sync in fake_nexus_server.full_syncs] == [True]
+        assert set(PayloadHash.objects.values_list("entity", "object_id")) == {
+            *(("users", str(user.pk)) for user in users),
+            ("structures", str(structure.pk)),
+        }
+
+        fake_nexus_server.requests.clear()
+        users[0].category = "user"  # Unchanged payload
+        users[0].save()
+        deleted_pk = users[1].pk
+        users[1].delete()
+        new_user = Item.objects.create(category="user")
+        call_command("nexus_full_sync")
+        assert len(fake_nexus_server.full_syncs) == 1
+        assert fake_nexus_server.stats()["calls"] == {"POST:users": 1, "DELETE:users": 1}
+        assert fake_nexus_server.requests_to("POST", "users")[0].payload == [
+            {"id": str(new_user.pk), "category": "user"}
+        ]
+        assert fake_nexus_server.requests_to("DELETE", "users")[0].payload == [{"id": str(deleted_pk)}]
+        assert set(fake_nexus_server.records["users"]) == {str(users[0].pk), str(users[2].pk), str(new_user.pk)}
+        assert set(PayloadHash.objects.filter(entity="users").values_list("object_id", flat=True)) == {
+            str(users[0].pk),
+            str(users[2].pk),
+            str(new_user.pk),
+        }
+
+        # Nothing changed, and the stored rows aren't rewritten
+        ctids = get_ctids()
+        fake_nexus_server.requests.clear()
+        call_command("nexus_full_sync")
+        assert fake_nexus_server.requests == []
+        assert get_ctids() == ctids
+
+    def test_full_resend(self, db, fake_nexus_server):
+        Item.objects.create(category="user")
+        call_command("nexus_full_sync")
+        fake_nexus_server.requests.clear()
+
+        ctids = get_ctids()
+        call_command("nexus_full_sync", full_resend=True)
+        assert fake_nexus_server.stats()["calls"] == {"POST:sync-start": 1, "POST:users": 1, "POST:sync-completed": 1}
+        # Only the changed hashes are written
+        assert get_ctids() == ctids
+
+    def test_parallel_entities(self, transactional_db, fake_nexus_server, mocker):
+        mocker.patch.object(Command, "PARALLEL_ENTITIES", True)
+        users = [Item.objects.create(category="user") for _ in range(2)]
+        structure = Item.objects.create(category="structure")
+        call_command("nexus_full_sync")
+        fake_nexus_server.requests.clear()
+
+        users[0].delete()
+        call_command("nexus_full_sync")
+        assert fake_nexus_server.stats()["calls"] == {"DELETE:users": 1}
+        assert set(PayloadHash.objects.values_list("entity", "object_id")) == {
+            ("users", str(users[1].pk)),
+            ("structures", str(structure.pk)),
+        }
+
+    def test_failure_keeps_previous_hashes(self, db, fake_nexus_server, mocker):
+        mocker.patch.object(Command, "retry_policy", RetryPolicy(max_attempts=1))
+        user = Item.objects.create(category="user")
+        call_command("nexus_full_sync")
+        [sent_at] = PayloadHash.objects.values_list("sent_at", flat=True)
+
+        user.category = "other"
+        user.save()
+        new_user = Item.objects.create(category="user")
+        fake_nexus_server.add_fault(method="POST", endpoint="users", status=400)
+        with pytest.raises(NexusAPIException):
+            call_command("nexus_full_sync")
+        assert list(PayloadHash.objects.exclude(payload_hash="").values_list("object_id", "sent_at")) == [
+            (str(user.pk), sent_at)
+        ]
+
+        # The changes are sent again by the next run
+        fake_nexus_server.faults.clear()
+        fake_nexus_server.requests.clear()
+        call_command("nexus_full_sync")
+        assert fake_nexus_server.requests_to("POST", "users")[0].payload == [
+            {"id": str(new_user.pk), "category": "user"}
+        ]
+        assert fake_nexus_server.requests_to("DELETE", "users")[0].payload == [{"id": str(user.pk)}]
+        assert list(PayloadHash.objects.exclude(payload_hash="").values_list("object_id", flat=True)) == [
+            str(new_user.pk)
+        ]
+
+    def test_missing_records_deleted_in_batches(self, db, fake_nexus_server, mocker):
+        mocker.patch("itoutils.django.nexus.payload_hashes.models.BATCH_SIZE", 1)
+        users = [Item.objects.create(category="user") for _ in range(3)]
+        call_command("nexus_full_sync")
+        fake_nexus_server.requests.clear()
+
+        Item.objects.filter(pk__in=[users[0].pk, users[1].pk]).delete()
+        call_command("nexus_full_sync")
+        assert [request.payload for request in fake_nexus_server.requests_to("DELETE", "users")] == [
+            [{"id": str(users[0].pk)}],
+            [{"id": str(users[1].pk)}],
+        ]
+        assert list(PayloadHash.objects.values_list("object_id", flat=True)) == [str(users[2].pk)]
+
+    def test_full_resend_deletes_missing_records(self, db, fake_nexus_server):
+        user = Item.objects.create(category="user")
+        call_command("nexus_full_sync")
+        fake_nexus_server.requests.clear()
+
+        user_pk = user.pk
+        user.delete()
+        call_command("nexus_full_sync", full_resend=True)
+        # Doesn't rely on sync-completed to delete them
+        assert fake_nexus_server.requests_to("DELETE", "users")[0].payload == [{"id": str(user_pk)}]
+        assert PayloadHash.objects.exists() is False
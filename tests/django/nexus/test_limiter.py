@@ -0,0 +1,118 @@
+import asyncio
+import threading
+import time
+
+import httpx
+import pytest
+
+from itoutils.django.nexus.api import AsyncNexusAPIClient, NexusAPIClient, NexusAPIException
+from itoutils.django.nexus.limiter import AdaptiveConcurrencyLimiter
+from itoutils.pytest import nexus_url
+
+
+class TestAdaptiveConcurrencyLimiter:
+    def test_additive_increase(self):
+        limiter = AdaptiveConcurrencyLimiter(initial_limit=2, max_limit=3)
+        for _ in range(2):
+            limiter.on_success(latency=0.1)
+        assert limiter.current_limit == 2
+        limiter.on_success(latency=0.1)
+        assert limiter.current_limit == 3
+        for _ in range(10):
+            limiter.on_success(latency=0.1)
+        assert limiter.current_limit == 3
+
+    def test_decrease_on_overload(self, caplog):
+        limiter = AdaptiveConcurrencyLimiter(initial_limit=8, decrease_cooldown=0)
+        limiter.on_result(0.1, httpx.HTTPStatusError("", request=None, response=httpx.Response(429)))
+        assert limiter.current_limit == 4
+        limiter.on_result(0.1, httpx.ReadTimeout("The read operation timed out"))
+        assert limiter.current_limit == 2
+        assert caplog.messages == [
+            "nexus concurrency limit decreased to 4 error=",
+            "nexus concurrency limit decreased to 2 error=The read operation timed out",
+        ]
+        assert caplog.records[-1].__dict__["nexus.concurrency_limit"] == 2
+
+    def test_no_decrease_on_other_errors(self):
+        limiter = AdaptiveConcurrencyLimiter(initial_limit=8)
+        limiter.on_result(0.1, httpx.HTTPStatusError("", request=None, response=httpx.Response(400)))
+        limiter.on_result(0.1, httpx.ConnectError("Connection refused"))
+        assert limiter.current_limit == 8
+
+    def test_decrease_on_high_latency(self):
+        limiter = AdaptiveConcurrencyLimiter(initial_limit=8, target_latency=1)
+        limiter.on_success(latency=2)
+        assert limiter.current_limit == 4
+
+    def test_decrease_cooldown_and_min_limit(self):
+        limiter = AdaptiveConcurrencyLimiter(initial_limit=8, min_limit=2, decrease_cooldown=60)
+        limiter.decrease("test")
+        limiter.decrease("test")
+        assert limiter.current_limit == 4
+        limiter.decrease_cooldown = 0
+        for _ in range(5):
+            limiter.decrease("test")
+        assert limiter.current_limit == 2
+
+    def test_limit_is_shared_between_threads(self):
+        limiter = AdaptiveConcurrencyLimiter(initial_limit=2, max_limit=2)
+        lock = threading.Lock()
+        in_flight = max_in_flight = 0
+
+        def work():
+            nonlocal in_flight, max_in_flight
+            with limiter.track():
+                with lock:
+                    in_flight += 1
+                    max_in_flight = max(in_flight, max_in_flight)
+                time.sleep(0.01)
+                with lock:
+                    in_flight -= 1
+
+        threads = [threading.Thread(target=work) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert max_in_flight == 2
+        assert limiter.in_flight == 0
+
+
+class TestClientWithLimiter:
+    def test_sync_client(self, mock_nexus_api):
+        limiter = AdaptiveConcurrencyLimiter(initial_limit=4)
+        mock_nexus_api.post(nexus_url("users")).respond(503)
+        client = NexusAPIClient(limiter=limiter)
+        with pytest.raises(NexusAPIException):
+            client.send_users([{"id": "1"}])
+        assert limiter.current_limit == 2
+        assert limiter.in_flight == 0
+
+        mock_nexus_api.post(nexus_url("users")).respond(200, json={})
+        for _ in range(3):
+            client.send_users([{"id": "1"}])
+        assert limiter.current_limit == 3
+
+    def test_async_client(self, mock_nexus_api):
+        limiter = AdaptiveConcurrencyLimiter(initial_limit=1, max_limit=1)
+        in_flight = max_in_flight = 0
+
+        async def side_effect(request):
+            nonlocal in_flight, max_in_flight
+            in_flight += 1
+            max_in_flight = max(in_flight, max_in_flight)
+            await asyncio.sleep(0.01)
+            in_flight -= 1
+            return httpx.Response(200, json={})
+
+        mock_nexus_api.post(nexus_url("users")).mock(side_effect=side_effect)
+
+        async def _run():
+            async with AsyncNexusAPIClient(limiter=limiter) as client:
+                await client.send_many(client.send_users, [[{"id": str(i)}] for i in range(4)])
+
+        asyncio.run(_run())
+        assert len(mock_nexus_api.calls) == 4
+        assert max_in_flight == 1
+        assert limiter.in_flight == 0
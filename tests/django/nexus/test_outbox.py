@@ -0,0 +1,144 @@
+import pytest
+from django.apps import apps
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.db.migrations.state import ProjectState
+
+from itoutils.django.nexus.api import NexusAPIException
+from itoutils.django.nexus.outbox.models import OutboxEntry
+from itoutils.django.nexus.outbox.operations import CreateNexusTriggers
+from testproject.testapp.models import SyncedItem
+from tests.django.factories import SyncedItemFactory, UserFactory
+
+
+class TestOutbox:
+    @pytest.fixture(autouse=True)
+    def setup_mocks(self, mock_synced_item, mocker):
+        mocker.patch.object(SyncedItem, "nexus_use_outbox", True)
+
+    def test_changes_are_stored(self, db, django_capture_on_commit_callbacks):
+        user = UserFactory()
+        with django_capture_on_commit_callbacks(execute=True) as callbacks:
+            synced_item = SyncedItemFactory(user=user)
+            SyncedItem.objects.bulk_create([SyncedItemFactory.build(user=user)])
+            SyncedItem.objects.filter(pk=synced_item.pk).update(sync_me=False)
+        assert callbacks == []
+        assert self.mocked_sync.call_count == 0
+        assert OutboxEntry.objects.count() == 3
+        entry = OutboxEntry.objects.order_by("pk").first()
+        assert (entry.model, entry.object_pk) == ("testapp.synceditem", str(synced_item.pk))
+
+    def test_drain(self, db, caplog):
+        user = UserFactory()
+        synced_items = [SyncedItemFactory(user=user) for _ in range(3)]
+        synced_items[0].sync_me = False
+        synced_items[0].save()
+        deleted_pk = synced_items[1].pk
+        synced_items[1].delete()
+        assert OutboxEntry.objects.count() == 5
+
+        call_command("drain_nexus_outbox", batch_size=2)
+        assert OutboxEntry.objects.count() == 0
+        synced = {obj.pk for call in self.mocked_sync.call_args_list for obj in call.args[0]}
+        deleted = {pk for call in self.mocked_delete.call_args_list for pk in call.args[0]}
+        assert synced == {synced_items[2].pk}
+        assert deleted == {synced_items[0].pk, deleted_pk}
+        assert caplog.messages[:3] == [
+            "Sent 2 Nexus outbox entries",
+            "Sent 2 Nexus outbox entries",
+            "Sent 1 Nexus outbox entries",
+        ]
+
+    def test_failure_keeps_entries(self, db, caplog):
+        SyncedItemFactory()
+        self.mocked_sync.side_effect = NexusAPIException
+        with pytest.raises(CommandError, match="Failed to send 1 Nexus outbox entries"):
+            call_command("drain_nexus_outbox")
+        assert list(OutboxEntry.objects.values_list("attempts", flat=True)) == [1]
+        assert "Failed to send 1 Nexus outbox entries of testapp.synceditem" in caplog.messages
+        assert not any(message.endswith("succeeded in 0.00 seconds") for message in caplog.messages)
+
+        self.mocked_sync.side_effect = None
+        call_command("drain_nexus_outbox")
+        assert OutboxEntry.objects.count() == 0
+
+    def test_failures_are_isolated_by_model(self, db, caplog):
+        synced_item = SyncedItemFactory()
+        OutboxEntry.objects.create(model="testapp.removedmodel", object_pk="1")
+        OutboxEntry.objects.create(model="testapp.item", object_pk="1")  # Not a Nexus model
+
+        with pytest.raises(CommandError, match="Failed to send 2 Nexus outbox entries"):
+            call_command("drain_nexus_outbox", batch_size=1)
+        self.mocked_sync.assert_called_once_with([synced_item])
+        with pytest.raises(CommandError, match="Failed to send 1 Nexus outbox entries"):
+            call_command("drain_nexus_outbox", batch_size=1)
+        assert "Unknown model testapp.removedmodel in 1 Nexus outbox entries" in caplog.messages
+        # The unknown model is a dead letter, the other failure will be retried
+        assert set(OutboxEntry.objects.values_list("model", "attempts")) == {
+            ("testapp.removedmodel", 5),
+            ("testapp.item", 2),
+        }
+
+    def test_max_attempts(self, db):
+        SyncedItemFactory()
+        self.mocked_sync.side_effect = NexusAPIException
+        for _ in range(2):
+            with pytest.raises(CommandError):
+                call_command("drain_nexus_outbox", max_attempts=2)
+        # A dead letter
+        call_command("drain_nexus_outbox", max_attempts=2)
+        assert self.mocked_sync.call_count == 2
+
+        self.mocked_sync.side_effect = None
+        call_command("drain_nexus_outbox", max_attempts=2, retry_failed=True)
+        assert self.mocked_sync.call_count == 3
+        assert OutboxEntry.objects.count() == 0
+
+
+class TestTriggers:
+    @pytest.fixture(autouse=True)
+    def setup_triggers(self, db, mock_synced_item, mocker):
+        mocker.patch.object(SyncedItem, "nexus_use_triggers", True)
+        self.operation = CreateNexusTriggers("synceditem", fields=["user_id", "sync_me"])
+        self.state = ProjectState.from_apps(apps)
+        with connection.schema_editor() as schema_editor:
+            self.operation.database_forwards("testapp", schema_editor, self.state, self.state)
+
+    def get_entries(self):
+        return list(OutboxEntry.objects.order_by("pk").values_list("model", "object_pk"))
+
+    def test_capture(self, django_capture_on_commit_callbacks):
+        user = UserFactory()
+        with django_capture_on_commit_callbacks(execute=True) as callbacks:
+            synced_item = SyncedItemFactory(user=user)
+            SyncedItem.objects.filter(pk=synced_item.pk).update(category="other")
+            with connection.cursor() as cursor:
+                cursor.execute("UPDATE testapp_synceditem SET sync_me = FALSE")
+                # Unchanged tracked columns
+                cursor.execute("UPDATE testapp_synceditem SET sync_me = FALSE")
+            user.delete()
+        assert callbacks == []
+        assert self.get_entries() == [("testapp.synceditem", str(synced_item.pk))] * 3
+
+    def test_drain(self):
+        synced_items = SyncedItemFactory.create_batch(2)
+        with connection.cursor() as cursor:
+            cursor.execute("DELETE FROM testapp_synceditem WHERE id = %s", [synced_items[0].pk])
+
+        call_command("drain_nexus_outbox")
+        assert OutboxEntry.objects.count() == 0
+        self.mocked_sync.assert_called_once_with([synced_items[1]])
+        self.mocked_delete.assert_called_once_with([synced_items[0].pk])
+
+    def test_backwards(self):
+        with connection.schema_editor() as schema_editor:
+            self.operation.database_backwards("testapp", schema_editor, self.state, self.state)
+        SyncedItemFactory()
+        assert self.get_entries() == []
+
+    def test_deconstruct(self):
+        assert self.operation.deconstruct() == (
+            "CreateNexusTriggers",
+            [],
+            {"model_name": "synceditem", "fields": ["user_id", "sync_me"]},
+        )
@@ -0,0 +1,50 @@
+import json
+
+import pytest
+
+from itoutils.django.nexus.api import NexusAPIClient, encode_json
+from itoutils.django.nexus.payloads import NexusMembership, NexusStructure, NexusUser
+from itoutils.pytest import nexus_url
+
+
+class TestNexusPayload:
+    @pytest.mark.parametrize(
+        "payload",
+        [
+            NexusUser(id="1", first_name='Jeanne "Jo"', last_name="Dupont\n", email="jeanne@mailinator.com"),
+            NexusStructure(id="2", name="Café l'Été ☕", department="2A", description="\x00 "),
+            NexusMembership(id="3", user_id="1", structure_id="2", role="admin"),
+        ],
+    )
+    def test_same_json_as_dicts(self, payload):
+        expected = json.dumps(payload.to_dict(), ensure_ascii=False, separators=(",", ":"), allow_nan=False)
+        assert payload.encode_json() == expected.encode()
+        assert encode_json(payload) == expected.encode()
+
+    def test_other_values(self):
+        payload = NexusMembership(id="1", user_id=2, structure_id=True, role=["admin", 1.5])
+        assert payload.encode_json() == b'{"id":"1","user_id":2,"structure_id":true,"role":["admin",1.5]}'
+
+    def test_no_dict(self):
+        with pytest.raises(AttributeError):
+            NexusUser(id="1").extra = "value"
+
+    def test_nested_in_list(self):
+        assert encode_json([NexusMembership(id="1", user_id="2", structure_id="3")]) == (
+            b'[{"id":"1","user_id":"2","structure_id":"3","role":null}]'
+        )
+
+    def test_sent_by_client(self, mock_nexus_api):
+        NexusAPIClient().send_users(NexusUser(id=str(i), first_name="Jeanne") for i in range(2))
+        [call] = mock_nexus_api.calls
+        assert call.request.url == nexus_url("users")
+        assert json.loads(call.request.content) == [
+            NexusUser(id="0", first_name="Jeanne").to_dict(),
+            NexusUser(id="1", first_name="Jeanne").to_dict(),
+        ]
+
+    def test_partial_record_sent_by_client(self, mock_nexus_api):
+        NexusAPIClient().send_users([NexusUser(id="1", first_name="Jo").to_partial_dict({"first_name"})])
+        [call] = mock_nexus_api.calls
+        assert call.request.method == "POST"
+        assert json.loads(call.request.content) == [{"id": "1", "first_name": "Jo"}]
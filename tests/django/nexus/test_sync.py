@@ -1,15 +1,18 @@
 import pytest
-
-from testproject.testapp.models import SyncedItem
+from django.contrib.auth.models import Group, User
+from django.db import connection, transaction
+from django.db.models import Exists, Q
+from django.db.models.signals import post_delete
+from django.test.utils import CaptureQueriesContext
+
+from itoutils.django.nexus.buffer import defer_nexus_sync
+from itoutils.django.nexus.outbox.models import OutboxEntry
+from testproject.testapp.models import SyncedItem, SyncedItemNote, SyncedItemQuerySet
 from tests.django.factories import SyncedItemFactory, UserFactory
 
 
+@pytest.mark.usefixtures("mock_synced_item")
 class TestSync:
-    @pytest.fixture(autouse=True)
-    def setup_mocks(self, mocker):
-        self.mocked_sync = mocker.patch("testproject.testapp.models.SyncedItem.nexus_sync")
-        self.mocked_delete = mocker.patch("testproject.testapp.models.SyncedItem.nexus_delete")
-
     def assert_mocked_calls(self, sync=False, delete=False, args=None):
         if sync:
             assert self.mocked_sync.call_count == 1
@@ -130,10 +133,439 @@ class TestSync:
             SyncedItem.objects.bulk_create([synced_item_1, synced_item_2], ignore_conflicts=True)
         assert SyncedItem.objects.count() == 0
 
-        with pytest.raises(NotImplementedError):
-            SyncedItem.objects.bulk_create([synced_item_1, synced_item_2], update_conflicts=True)
-        assert SyncedItem.objects.count() == 0
-
         with django_capture_on_commit_callbacks(execute=True):
             SyncedItem.objects.bulk_create([synced_item_1, synced_item_2])
         self.assert_mocked_calls(sync=True, args=[synced_item_1, synced_item_2])
+
+
+@pytest.mark.usefixtures("mock_synced_item")
+class TestSyncBuffer:
+    def test_single_call_per_transaction(self, db, django_capture_on_commit_callbacks, django_assert_num_queries):
+        user = UserFactory()
+        with django_capture_on_commit_callbacks(execute=True) as callbacks:
+            synced_items = [SyncedItemFactory(user=user) for _ in range(3)]
+            synced_items += SyncedItem.objects.bulk_create([SyncedItemFactory.build(user=user)])
+            synced_items[0].sync_me = False
+            synced_items[0].save()
+            deleted_pk = synced_items[1].pk
+            synced_items[1].delete()
+        assert len(callbacks) == 6
+        self.mocked_sync.assert_called_once()
+        assert set(self.mocked_sync.call_args.args[0]) == {synced_items[2], synced_items[3]}
+        self.mocked_delete.assert_called_once()
+        assert set(self.mocked_delete.call_args.args[0]) == {synced_items[0].pk, deleted_pk}
+        # Callbacks run after the first one do nothing
+        with django_assert_num_queries(0):
+            callbacks[-1]()
+        assert self.mocked_sync.call_count == 1
+
+    def test_last_change_wins(self, db, django_capture_on_commit_callbacks):
+        synced_item = SyncedItemFactory(sync_me=False)
+        with django_capture_on_commit_callbacks(execute=True):
+            SyncedItem.objects.filter(pk=synced_item.pk).update(sync_me=True)
+            synced_item.sync_me = True
+            synced_item.save()
+            SyncedItem.objects.filter(pk=synced_item.pk).update(sync_me=False)
+        assert self.mocked_sync.call_count == 0
+        self.mocked_delete.assert_called_once_with([synced_item.pk])
+
+    def test_savepoint_rollback(self, db, django_capture_on_commit_callbacks):
+        synced_item = SyncedItemFactory()
+        synced_item_pk = synced_item.pk
+        with django_capture_on_commit_callbacks(execute=True):
+            synced_item.user = UserFactory()
+            synced_item.save()
+            try:
+                with transaction.atomic():
+                    synced_item.delete()
+                    raise ValueError
+            except ValueError:
+                pass
+        # The object still exists
+        [[synced]] = self.mocked_sync.call_args.args
+        assert synced.pk == synced_item_pk
+        assert self.mocked_delete.call_count == 0
+
+    def test_rolled_back_buffer_is_not_reused(self, db, django_capture_on_commit_callbacks):
+        user = UserFactory()
+        with django_capture_on_commit_callbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    SyncedItemFactory(user=user)
+                    raise ValueError
+            except ValueError:
+                pass
+            synced_item = SyncedItemFactory(user=user)
+        self.mocked_sync.assert_called_once_with([synced_item])
+
+    def test_autocommit(self, transactional_db):
+        synced_item = SyncedItemFactory()
+        self.mocked_sync.assert_called_once_with([synced_item])
+        synced_item_pk = synced_item.pk
+        synced_item.delete()
+        self.mocked_delete.assert_called_once_with([synced_item_pk])
+
+
+@pytest.mark.usefixtures("mock_synced_item")
+class TestUpdateReturning:
+    def test_single_query(self, db, django_capture_on_commit_callbacks, django_assert_num_queries):
+        with django_capture_on_commit_callbacks(execute=True):
+            synced_item_1 = SyncedItemFactory(category="a")
+            synced_item_2 = SyncedItemFactory(category="a", user__is_active=False)
+            SyncedItemFactory(category="b")
+        self.mocked_sync.reset_mock()
+        self.mocked_delete.reset_mock()
+
+        with django_capture_on_commit_callbacks(execute=True):
+            with django_assert_num_queries(1):
+                # With a join
+                assert (
+                    SyncedItem.objects.filter(category="a", user__username__startswith="user").update(sync_me=False)
+                    == 2
+                )
+        assert self.mocked_sync.call_count == 0
+        assert set(self.mocked_delete.call_args.args[0]) == {synced_item_1.pk, synced_item_2.pk}
+
+    def test_empty_queryset(self, db, django_capture_on_commit_callbacks, django_assert_num_queries):
+        SyncedItemFactory()
+        with django_capture_on_commit_callbacks(execute=True) as callbacks:
+            with django_assert_num_queries(0):
+                assert SyncedItem.objects.none().update(sync_me=False) == 0
+        assert callbacks == []
+
+    def test_fallback(self, db, django_capture_on_commit_callbacks, django_assert_num_queries, mocker):
+        mocker.patch("testproject.testapp.models.SyncedItemQuerySet._update_returning_pks", return_value=None)
+        synced_item = SyncedItemFactory()
+        with django_capture_on_commit_callbacks(execute=True):
+            with django_assert_num_queries(2):
+                assert SyncedItem.objects.update(sync_me=False) == 1
+        self.mocked_delete.assert_called_once_with([synced_item.pk])
+
+
+@pytest.mark.usefixtures("mock_synced_item")
+class TestDeleteInChunks:
+    def test_each_chunk_is_sent(self, transactional_db):
+        user = UserFactory()
+        synced_items = [SyncedItemFactory(user=user, category="a") for _ in range(5)]
+        kept_item = SyncedItemFactory(user=user, category="b")
+        self.mocked_delete.reset_mock()
+
+        assert SyncedItem.objects.filter(category="a").delete_in_chunks(chunk_size=2) == (
+            5,
+            {"testapp.SyncedItem": 5},
+        )
+        assert [call.args[0] for call in self.mocked_delete.call_args_list] == [
+            [synced_items[0].pk, synced_items[1].pk],
+            [synced_items[2].pk, synced_items[3].pk],
+            [synced_items[4].pk],
+        ]
+        assert list(SyncedItem.objects.all()) == [kept_item]
+
+    def test_in_transaction(self, db, django_capture_on_commit_callbacks):
+        synced_items = [SyncedItemFactory() for _ in range(3)]
+        with django_capture_on_commit_callbacks(execute=True):
+            assert SyncedItem.objects.delete_in_chunks(chunk_size=2) == (3, {"testapp.SyncedItem": 3})
+        self.mocked_delete.assert_called_once()
+        assert set(self.mocked_delete.call_args.args[0]) == {synced_item.pk for synced_item in synced_items}
+
+    def test_nothing_to_delete(self, db):
+        assert SyncedItem.objects.delete_in_chunks() == (0, {})
+
+
+@pytest.mark.usefixtures("mock_synced_item")
+class TestBulkCreateUpdateConflicts:
+    @pytest.fixture(name="existing_item")
+    def existing_item_fixture(self, db, django_capture_on_commit_callbacks):
+        with django_capture_on_commit_callbacks(execute=True):
+            existing_item = SyncedItemFactory(category="a")
+        self.mocked_sync.reset_mock()
+        return existing_item
+
+    def upsert(self, existing_item, update_fields):
+        return SyncedItem.objects.bulk_create(
+            [
+                SyncedItem(pk=existing_item.pk, user=existing_item.user, category="b", sync_me=False),
+                SyncedItem(pk=existing_item.pk + 1, user=existing_item.user, category="b"),
+            ],
+            update_conflicts=True,
+            unique_fields=["id"],
+            update_fields=update_fields,
+        )
+
+    def test_untracked_fields_updated(self, existing_item, django_capture_on_commit_callbacks):
+        with django_capture_on_commit_callbacks(execute=True):
+            self.upsert(existing_item, ["category"])
+        # Only the inserted row is synced
+        [[synced]] = self.mocked_sync.call_args.args
+        assert synced.pk == existing_item.pk + 1
+        assert self.mocked_delete.call_count == 0
+        assert set(SyncedItem.objects.values_list("category", flat=True)) == {"b"}
+
+    def test_tracked_fields_updated(self, existing_item, django_capture_on_commit_callbacks):
+        with django_capture_on_commit_callbacks(execute=True):
+            self.upsert(existing_item, ["category", "sync_me"])
+        [[synced]] = self.mocked_sync.call_args.args
+        assert synced.pk == existing_item.pk + 1
+        self.mocked_delete.assert_called_once_with([existing_item.pk])
+
+    def test_inserted_rows_found_in_the_same_transaction(self, transactional_db, mocker):
+        existing_item = SyncedItemFactory(category="a")
+        self.mocked_sync.reset_mock()
+        get_inserted_pks = SyncedItemQuerySet._get_inserted_pks
+        in_atomic_block = []
+
+        def spy(queryset, pks):
+            in_atomic_block.append(connection.in_atomic_block)
+            return get_inserted_pks(queryset, pks)
+
+        mocker.patch.object(SyncedItemQuerySet, "_get_inserted_pks", spy)
+        # Outside of a transaction, a lock taken between the upsert and the xmax check would hide inserted rows
+        self.upsert(existing_item, ["category"])
+        assert in_atomic_block == [True]
+        [[synced]] = self.mocked_sync.call_args.args
+        assert synced.pk == existing_item.pk + 1
+
+
+class TestPartialSync:
+    @pytest.fixture(autouse=True)
+    def setup_mocks(self, mock_synced_item, mocker):
+        self.mocked_partial_sync = mocker.patch.object(SyncedItem, "nexus_partial_sync")
+        mocker.patch.object(SyncedItem, "nexus_partial_fields", ["user_id"])
+
+    @pytest.fixture(name="synced_item")
+    def synced_item_fixture(self, db, django_capture_on_commit_callbacks):
+        with django_capture_on_commit_callbacks(execute=True):
+            synced_item = SyncedItemFactory()
+        # Created objects are always fully synced
+        self.mocked_sync.assert_called_once_with([synced_item])
+        self.mocked_sync.reset_mock()
+        return synced_item
+
+    def test_save(self, synced_item, django_capture_on_commit_callbacks):
+        with django_capture_on_commit_callbacks(execute=True):
+            synced_item.user = UserFactory()
+            synced_item.save()
+        self.mocked_partial_sync.assert_called_once_with([(synced_item, {"user_id"})])
+        assert self.mocked_sync.call_count == 0
+
+    def test_update(self, synced_item, django_capture_on_commit_callbacks):
+        with django_capture_on_commit_callbacks(execute=True):
+            SyncedItem.objects.update(user=UserFactory())
+        self.mocked_partial_sync.assert_called_once_with([(synced_item, {"user_id"})])
+
+    def test_other_fields_changed(self, synced_item, django_capture_on_commit_callbacks):
+        with django_capture_on_commit_callbacks(execute=True):
+            synced_item.user = UserFactory()
+            synced_item.save()
+            SyncedItem.objects.update(sync_me=True)
+        assert self.mocked_partial_sync.call_count == 0
+        self.mocked_sync.assert_called_once_with([synced_item])
+
+    def test_condition_fields_changed(self, db, django_capture_on_commit_callbacks, mocker):
+        mocker.patch.object(SyncedItem, "nexus_partial_fields", ["user_id", "sync_me"])
+        mocker.patch.object(SyncedItem, "nexus_sync_condition", Q(sync_me=True))
+        with django_capture_on_commit_callbacks(execute=True):
+            synced_item = SyncedItemFactory(sync_me=False)
+        self.mocked_sync.reset_mock()
+        self.mocked_delete.reset_mock()
+
+        # The object wasn't in Nexus: it must be fully synced
+        with django_capture_on_commit_callbacks(execute=True):
+            SyncedItem.objects.update(sync_me=True)
+        assert self.mocked_partial_sync.call_count == 0
+        self.mocked_sync.assert_called_once_with([synced_item])
+
+        # Other partial fields are still partially synced
+        self.mocked_sync.reset_mock()
+        with django_capture_on_commit_callbacks(execute=True):
+            SyncedItem.objects.update(user=UserFactory())
+        self.mocked_partial_sync.assert_called_once_with([(synced_item, {"user_id"})])
+        assert self.mocked_sync.call_count == 0
+
+    def test_unknown_condition_fields(self, db, django_capture_on_commit_callbacks, mocker):
+        mocker.patch.object(SyncedItem, "nexus_sync_condition", Q(Exists(User.objects.filter(is_active=True))))
+        with django_capture_on_commit_callbacks(execute=True):
+            synced_item = SyncedItemFactory()
+        self.mocked_sync.reset_mock()
+        with django_capture_on_commit_callbacks(execute=True):
+            SyncedItem.objects.update(user=UserFactory())
+        assert self.mocked_partial_sync.call_count == 0
+        self.mocked_sync.assert_called_once_with([synced_item])
+
+
+class TestSyncCondition:
+    @pytest.fixture(autouse=True)
+    def setup_mocks(self, mock_synced_item, mocker):
+        mocker.patch.object(SyncedItem, "nexus_sync_condition", Q(sync_me=True, user__is_active=True))
+        self.mocked_should_sync = mocker.patch.object(SyncedItem, "should_sync_to_nexus")
+
+    def test_update(self, db, django_capture_on_commit_callbacks, django_assert_num_queries):
+        with django_capture_on_commit_callbacks(execute=True):
+            synced_item = SyncedItemFactory(category="a")
+            inactive_user_item = SyncedItemFactory(category="a", user__is_active=False)
+            not_synced_item = SyncedItemFactory(category="b", sync_me=False)
+        self.mocked_sync.reset_mock()
+        self.mocked_delete.reset_mock()
+
+        with django_capture_on_commit_callbacks() as callbacks:
+            SyncedItem.objects.update(user_id=synced_item.user_id)
+            SyncedItem.objects.filter(category="a").update(sync_me=True)
+        with django_assert_num_queries(1):
+            callbacks[0]()
+        # Only the objects to sync were fetched
+        self.mocked_sync.assert_called_once()
+        assert set(self.mocked_sync.call_args.args[0]) == {synced_item, inactive_user_item}
+        self.mocked_delete.assert_called_once_with([not_synced_item.pk])
+        assert self.mocked_should_sync.call_count == 0
+
+    def test_multi_valued_relation(self, db, django_capture_on_commit_callbacks, mocker):
+        mocker.patch.object(SyncedItem, "nexus_sync_condition", Q(user__groups__name__startswith="g"))
+        synced_item = SyncedItemFactory()
+        synced_item.user.groups.add(Group.objects.create(name="g1"), Group.objects.create(name="g2"))
+        with django_capture_on_commit_callbacks(execute=True):
+            SyncedItem.objects.update(sync_me=False)
+        self.mocked_sync.assert_called_once_with([synced_item])
+        assert self.mocked_delete.call_count == 0
+
+    def test_deleted(self, db, django_capture_on_commit_callbacks):
+        synced_item = SyncedItemFactory(user__is_active=False)
+        synced_item_pk = synced_item.pk
+        with django_capture_on_commit_callbacks(execute=True):
+            synced_item.delete()
+        self.mocked_delete.assert_called_once_with([synced_item_pk])
+        assert self.mocked_sync.call_count == 0
+
+
+@pytest.mark.usefixtures("mock_synced_item")
+class TestDeferNexusSync:
+    def test_single_callback(self, db, django_capture_on_commit_callbacks):
+        user = UserFactory()
+        with django_capture_on_commit_callbacks(execute=True) as callbacks:
+            with defer_nexus_sync():
+                synced_items = [SyncedItemFactory(user=user) for _ in range(3)]
+                with defer_nexus_sync():
+                    synced_items[0].sync_me = False
+                    synced_items[0].save()
+                assert callbacks == []
+                assert transaction.get_connection().run_on_commit == []
+        assert len(callbacks) == 1
+        assert set(self.mocked_sync.call_args.args[0]) == set(synced_items[1:])
+        self.mocked_delete.assert_called_once_with([synced_items[0].pk])
+
+    def test_outbox(self, db, mocker):
+        mocker.patch.object(SyncedItem, "nexus_use_outbox", True)
+        with defer_nexus_sync():
+            synced_item = SyncedItemFactory()
+            synced_item.sync_me = False
+            synced_item.save()
+            assert OutboxEntry.objects.count() == 0
+        assert list(OutboxEntry.objects.values_list("object_pk", flat=True)) == [str(synced_item.pk)]
+
+    def test_autocommit(self, transactional_db, mocker):
+        mocker.patch("itoutils.django.nexus.buffer.BATCH_SIZE", 2)
+        user = UserFactory()
+        with defer_nexus_sync():
+            synced_items = [SyncedItemFactory(user=user) for _ in range(3)]
+            assert self.mocked_sync.call_count == 0
+        # Sent by batches
+        assert self.mocked_sync.call_count == 2
+        assert {obj for call in self.mocked_sync.call_args_list for obj in call.args[0]} == set(synced_items)
+
+    def test_rolled_back(self, db, django_capture_on_commit_callbacks):
+        with django_capture_on_commit_callbacks(execute=True) as callbacks:
+            with pytest.raises(ValueError):
+                with transaction.atomic(), defer_nexus_sync():
+                    SyncedItemFactory()
+                    raise ValueError
+        assert callbacks == []
+
+
+@pytest.mark.usefixtures("mock_synced_item")
+class TestCascadedDeletion:
+    def test_delete_cascaded_objects(self, db, django_capture_on_commit_callbacks):
+        user = UserFactory()
+        with django_capture_on_commit_callbacks(execute=True):
+            synced_items = SyncedItemFactory.create_batch(3, user=user)
+            other_synced_item = SyncedItemFactory()
+        self.mocked_sync.reset_mock()
+
+        with django_capture_on_commit_callbacks(execute=True):
+            user.delete()
+        assert self.mocked_sync.call_count == 0
+        self.mocked_delete.assert_called_once()
+        assert set(self.mocked_delete.call_args.args[0]) == {synced_item.pk for synced_item in synced_items}
+        assert SyncedItem.objects.get() == other_synced_item
+
+    def test_delete_cascaded_objects_from_queryset(self, transactional_db):
+        users = UserFactory.create_batch(2)
+        synced_items = [SyncedItemFactory(user=user) for user in users for _ in range(2)]
+        self.mocked_sync.reset_mock()
+
+        # Outside of a transaction, sent once the deletion is committed
+        User.objects.filter(pk__in=[user.pk for user in users]).delete()
+        self.mocked_delete.assert_called_once()
+        assert set(self.mocked_delete.call_args.args[0]) == {synced_item.pk for synced_item in synced_items}
+
+    def test_delete_cascaded_objects_without_mixins(self, transactional_db):
+        synced_items = SyncedItemFactory.create_batch(2)
+        notes = [SyncedItemNote.objects.create(item=synced_item, text="note") for synced_item in synced_items]
+        self.mocked_sync.reset_mock()
+
+        deleted_notes = []
+
+        def record_deleted_note(sender, instance, **kwargs):
+            deleted_notes.append(instance.pk)
+
+        # The notes are collected instead of fast deleted, but they are not Nexus objects
+        post_delete.connect(record_deleted_note, sender=SyncedItemNote)
+        try:
+            SyncedItem.objects.filter(pk__in=[synced_item.pk for synced_item in synced_items]).delete()
+        finally:
+            post_delete.disconnect(record_deleted_note, sender=SyncedItemNote)
+        assert sorted(deleted_notes) == sorted(note.pk for note in notes)
+        self.mocked_delete.assert_called_once()
+        assert set(self.mocked_delete.call_args.args[0]) == {synced_item.pk for synced_item in synced_items}
+
+    def test_queryset_delete_only_fetches_pks(self, db, django_capture_on_commit_callbacks):
+        synced_items = SyncedItemFactory.create_batch(3)
+        with django_capture_on_commit_callbacks(execute=True):
+            with CaptureQueriesContext(connection) as context:
+                assert SyncedItem.objects.filter(category=synced_items[0].category).delete() == (
+                    1,
+                    {"testapp.SyncedItem": 1},
+                )
+                SyncedItem.objects.all().delete()
+        # Items may have notes, so they are fetched, but the notes are fast deleted without being fetched
+        assert [query["sql"].split(" FROM ")[0] for query in context.captured_queries] == [
+            'SELECT "testapp_synceditem"."id", "testapp_synceditem"."user_id", "testapp_synceditem"."category", '
+            '"testapp_synceditem"."sync_me"',
+            "DELETE",
+            "DELETE",
+            'SELECT "testapp_synceditem"."id", "testapp_synceditem"."user_id", "testapp_synceditem"."category", '
+            '"testapp_synceditem"."sync_me"',
+            "DELETE",
+            "DELETE",
+        ]
+        self.mocked_delete.assert_called_once_with([synced_item.pk for synced_item in synced_items])
+
+    def test_delete_cascaded_objects_in_outbox(self, db, mocker):
+        mocker.patch.object(SyncedItem, "nexus_use_outbox", True)
+        user = UserFactory()
+        synced_items = SyncedItemFactory.create_batch(2, user=user)
+        OutboxEntry.objects.all().delete()
+
+        user.delete()
+        assert sorted(OutboxEntry.objects.values_list("object_pk", flat=True)) == sorted(
+            str(synced_item.pk) for synced_item in synced_items
+        )
+
+    def test_rolled_back(self, db, django_capture_on_commit_callbacks):
+        user = UserFactory()
+        SyncedItemFactory(user=user)
+        with django_capture_on_commit_callbacks(execute=True) as callbacks:
+            with pytest.raises(ValueError):
+                with transaction.atomic():
+                    user.delete()
+                    raise ValueError
+        assert callbacks == []
+        assert self.mocked_delete.call_count == 0
@@ -19,3 +19,15 @@ def test_has_data_changed_mixin():
     new_item.parent = new_item
     assert new_item.has_data_changed(["category"])
     assert new_item.has_data_changed(["parent_id"])
+
+
+@pytest.mark.django_db
+def test_get_changed_fields():
+    item = Item(category="a")
+    assert item.get_changed_fields(["category", "parent_id"]) == {"category", "parent_id"}
+
+    item.save()
+    assert item.get_changed_fields(["category", "parent_id"]) == set()
+
+    item.category = "b"
+    assert item.get_changed_fields(["category", "parent_id"]) == {"category"}